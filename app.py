@@ -1,18 +1,18 @@
 import streamlit as st
-import aiosqlite
-import asyncio
+import streamlit.components.v1 as components
+import storage
+from leaderboard import leaderboard
+from cache import TTLCache
+import migrations
+import history
+import instrumentation
+from sessions import session_store
+import credentials
+from bridge import bridge
 import json
+import logging
 import os
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
-import hashlib
-import threading
-import sqlite3
-import random
 import time
-from PIL import Image
-import requests
-from io import BytesIO
 
 # Настройка страницы
 st.set_page_config(
@@ -24,208 +24,271 @@ st.set_page_config(
 # Функция инициализации базы данных
 async def init_db():
     try:
-        async with aiosqlite.connect("casino.db") as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    balance INTEGER DEFAULT 1000,
-                    first_name TEXT,
-                    last_name TEXT,
-                    telegram_username TEXT
-                )
-            """)
-            await db.commit()
-            print("База данных успешно инициализирована")
-    except Exception as e:
-        print(f"Ошибка при инициализации базы данных: {str(e)}")
-
-# Инициализация базы данных при запуске
-try:
-    asyncio.run(init_db())
-except Exception as e:
-    print(f"Ошибка при запуске: {str(e)}")
-
-# Инициализация состояния сессии
-if 'user_data' not in st.session_state:
-    st.session_state.user_data = None
-if 'is_logged_in' not in st.session_state:
-    st.session_state.is_logged_in = False
+        # Общие с ботом миграции; при актуальной схеме DDL не выполняется
+        await migrations.migrate()
+        logging.debug("База данных успешно инициализирована")
+    except Exception:
+        logging.exception("Ошибка при инициализации базы данных")
+
+# Разовая инициализация процесса: логи и /metrics, схема базы и фоновое
+# удаление истекших сессий. Streamlit выполняет скрипт заново при каждом
+# действии пользователя, а st.cache_resource - только при первом прогоне
+@st.cache_resource
+def start_runtime():
+    instrumentation.setup_logging()
+    instrumentation.register_gauges("pool", storage.pool_metrics)
+    instrumentation.register_gauges("bridge", bridge.metrics)
+    instrumentation.register_gauges("sessions", session_store.metrics)
+    try:
+        bridge.run(init_db())
+    except Exception:
+        logging.exception("Ошибка при запуске")
+    expiry = bridge.submit(session_store.run_expiry())
+    metrics = bridge.run(instrumentation.start_server()) if instrumentation.METRICS_PORT else None
+    return expiry, metrics
 
-# Функция для сохранения состояния сессии
+# Функция для сохранения состояния сессии: токен сессии хранится в адресе
+# страницы, данные пользователя - в хранилище сессий на сервере.
+# Адрес с токеном попадает в историю браузера и в ссылки - токен дает
+# вход в аккаунт, пока сессия не истекла или не удалена выходом
 def save_session_state():
     if st.session_state.is_logged_in and st.session_state.user_data:
-        with open('session.json', 'w') as f:
-            json.dump({
-                'is_logged_in': st.session_state.is_logged_in,
-                'user_data': st.session_state.user_data
-            }, f)
+        token = bridge.run(session_store.create(st.session_state.user_data))
+        st.query_params["session"] = token
 
-# Функция для загрузки состояния сессии
+# Функция для загрузки состояния сессии после перезагрузки страницы
 def load_session_state():
-    try:
-        with open('session.json', 'r') as f:
-            data = json.load(f)
-            st.session_state.is_logged_in = data['is_logged_in']
-            st.session_state.user_data = data['user_data']
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+    if st.session_state.is_logged_in:
+        return
+    token = st.query_params.get("session")
+    if not token:
+        return
+    user_data = bridge.run(session_store.get(token))
+    if user_data:
+        st.session_state.is_logged_in = True
+        st.session_state.user_data = user_data
+    else:
+        del st.query_params["session"]
 
-# Загрузка состояния сессии при запуске
-load_session_state()
+# Функция для удаления сессии при выходе
+# (кнопка "Выйти" и ошибка загрузки данных). Токен убирается из адреса
+# даже при ошибке базы, иначе следующий прогон снова выполнит вход
+def clear_session_state():
+    token = st.query_params.get("session")
+    if token:
+        del st.query_params["session"]
+        try:
+            bridge.run(session_store.delete(token))
+        except Exception:
+            logging.exception("Не удалось удалить сессию")
+    st.session_state.is_logged_in = False
+    st.session_state.user_data = None
+    # Страницы истории и таблицы лидеров относятся к вышедшему пользователю
+    for key in ("history_pages", "top_page"):
+        st.session_state.pop(key, None)
+
+# Инициализация состояния при первом прогоне скрипта в сессии браузера:
+# вход по токену из адреса страницы нужен только при ее открытии
+def init_session():
+    if 'is_logged_in' in st.session_state:
+        return
+    st.session_state.user_data = None
+    st.session_state.is_logged_in = False
+    load_session_state()
 
-# Функция для хеширования пароля
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Функция для хеширования пароля (соль и KDF, вычисляется вне цикла событий)
+async def hash_password(password):
+    return await credentials.hash_password(password)
 
 # Функция для проверки пароля
-def verify_password(password, hashed_password):
-    return hash_password(password) == hashed_password
+async def verify_password(password, hashed_password):
+    return await credentials.verify_password(password, hashed_password)
 
 # Функция для регистрации пользователя
+@instrumentation.timed("app.register_user")
 async def register_user(username, password, first_name=None, last_name=None, telegram_username=None):
     try:
-        print(f"Попытка регистрации пользователя: {username}")
-        async with aiosqlite.connect("casino.db") as db:
-            # Проверяем, существует ли пользователь
-            async with db.execute("SELECT username FROM users WHERE username = ?", (username,)) as cursor:
-                existing_user = await cursor.fetchone()
-                if existing_user:
-                    print(f"Пользователь {username} уже существует")
-                    return False
-            
-            # Получаем максимальный user_id
-            async with db.execute("SELECT MAX(user_id) FROM users") as cursor:
-                max_id = await cursor.fetchone()
-                new_user_id = (max_id[0] or 0) + 1
-                print(f"Новый user_id: {new_user_id}")
-            
-            hashed_password = hash_password(password)
-            print(f"Хешированный пароль: {hashed_password}")
-            
-            try:
-                await db.execute("""
-                    INSERT INTO users (user_id, username, password, first_name, last_name, telegram_username)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (new_user_id, username, hashed_password, first_name, last_name, telegram_username))
-                await db.commit()
-                print(f"Пользователь {username} успешно зарегистрирован")
-                return True
-            except aiosqlite.IntegrityError as e:
-                print(f"Ошибка целостности при регистрации: {str(e)}")
-                return False
-            except Exception as e:
-                print(f"Неожиданная ошибка при регистрации: {str(e)}")
-                return False
-    except Exception as e:
-        print(f"Общая ошибка при регистрации: {str(e)}")
+        # Хеш считается до захвата соединения из пула: KDF долгий
+        hashed_password = await hash_password(password)
+        # Один INSERT: занятое имя отсекает UNIQUE, user_id выдает база
+        new_user_id = await storage.create_user(username, hashed_password, first_name, last_name, telegram_username)
+        if new_user_id is None:
+            logging.debug("Регистрация %s: имя занято", username)
+            return False
+        leaderboard.update(new_user_id, 1000, username)
+        logging.info("Зарегистрирован пользователь %s (user_id %d)", username, new_user_id)
+        return True
+    except Exception:
+        logging.exception("Ошибка при регистрации %s", username)
         return False
 
 # Функция для аутентификации пользователя
+@instrumentation.timed("app.authenticate_user")
 async def authenticate_user(username, password):
     try:
-        print(f"Попытка аутентификации пользователя: {username}")
-        async with aiosqlite.connect("casino.db") as db:
-            db.row_factory = sqlite3.Row
+        async with storage.connection() as db:
             cursor = await db.execute("SELECT * FROM users WHERE username = ?", (username,))
             user = await cursor.fetchone()
             await cursor.close()
-            
-            if user:
-                print(f"Пользователь {username} найден в базе данных")
-                user_dict = {
-                    'user_id': user['user_id'],
-                    'username': user['username'],
-                    'password': user['password'],
-                    'balance': user['balance'],
-                    'first_name': user['first_name'],
-                    'last_name': user['last_name'],
-                    'telegram_username': user['telegram_username']
-                }
-                if verify_password(password, user_dict['password']):
-                    print(f"Пароль для пользователя {username} верный")
-                    return user_dict
-                else:
-                    print(f"Неверный пароль для пользователя {username}")
+        
+        # Проверка пароля идет после возврата соединения в пул: KDF долгий
+        if user:
+            user_dict = {
+                'user_id': user['user_id'],
+                'username': user['username'],
+                'password': user['password'],
+                'balance': user['balance'],
+                'first_name': user['first_name'],
+                'last_name': user['last_name'],
+                'telegram_username': user['telegram_username']
+            }
+            if await verify_password(password, user_dict['password']):
+                logging.debug("Вход %s: пароль верный", username)
+                # Перехеширование старых или слабых хешей при входе
+                if credentials.needs_rehash(user_dict['password']):
+                    user_dict['password'] = await hash_password(password)
+                    async with storage.connection() as db:
+                        await db.execute(
+                            "UPDATE users SET password = ? WHERE user_id = ?",
+                            (user_dict['password'], user_dict['user_id'])
+                        )
+                        await db.commit()
+                return user_dict
             else:
-                print(f"Пользователь {username} не найден")
-            return None
-    except Exception as e:
-        print(f"Ошибка при аутентификации: {str(e)}")
+                logging.debug("Вход %s: неверный пароль", username)
+        else:
+            logging.debug("Вход %s: пользователь не найден", username)
+        return None
+    except Exception:
+        logging.exception("Ошибка при аутентификации %s", username)
         return None
 
+# Кэш балансов по user_id: перезапуски скрипта не ходят в базу.
+# Изменения из этого процесса обновляют кэш сразу, изменения бота
+# становятся видны по истечении BALANCE_CACHE_TTL секунд.
+# st.cache_resource сохраняет кэш между перезапусками скрипта.
+@st.cache_resource
+def get_balance_cache():
+    return TTLCache(
+        maxsize=int(os.getenv("BALANCE_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("BALANCE_CACHE_TTL", "30")),
+    )
+
+balance_cache = get_balance_cache()
+
+# Кэш страниц истории по (user_id, курсор). Новые операции попадают только
+# на первую страницу (курсор None), поэтому при изменении баланса
+# сбрасывается только она; операции бота видны через HISTORY_CACHE_TTL секунд.
+@st.cache_resource
+def get_history_cache():
+    return TTLCache(
+        maxsize=int(os.getenv("HISTORY_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("HISTORY_CACHE_TTL", "30")),
+    )
+
+history_cache = get_history_cache()
+
+# Функция для учета нового баланса в кэше, истории и таблице лидеров
+def balance_changed(user_id, balance):
+    history_cache.invalidate((user_id, None))
+    if balance is None:
+        balance_cache.invalidate(user_id)
+        return
+    balance_cache.set(user_id, balance)
+    leaderboard.update(user_id, balance)
+
 # Функция для получения баланса пользователя
 async def get_user_balance(user_id):
-    async with aiosqlite.connect("casino.db") as db:
-        db.row_factory = sqlite3.Row  # Устанавливаем row_factory для получения словаря
-        async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result['balance'] if result else 1000  # Используем доступ по ключу
-
-# Функция для обновления баланса
-async def update_balance(user_id, amount):
-    async with aiosqlite.connect("casino.db") as db:
-        await db.execute("""
-            UPDATE users SET balance = balance + ? WHERE user_id = ?
-        """, (amount, user_id))
-        await db.commit()
+    balance = balance_cache.get(user_id)
+    if balance is not None:
+        return balance
+    balance = await storage.get_balance(user_id)
+    if balance is None:
+        return 1000
+    balance_cache.set(user_id, balance)
+    return balance
+
+# Функция для расчета ставки: проверка средств и выплата одним выражением
+async def settle_bet(user_id, bet, payout):
+    balance = await storage.settle_bet(user_id, bet, payout)
+    balance_changed(user_id, balance)
+    if balance is not None:
+        instrumentation.count("spins")
+        if payout > 0:
+            instrumentation.count("wins")
+    return balance
 
 # Функция для получения топа игроков
-async def get_top_players():
-    async with aiosqlite.connect("casino.db") as db:
-        db.row_factory = sqlite3.Row  # Устанавливаем row_factory для получения словаря
-        async with db.execute("SELECT * FROM users ORDER BY balance DESC LIMIT 10") as cursor:
-            players = await cursor.fetchall()
-            return [dict(player) for player in players]  # Преобразуем каждую строку в словарь
-
-# Функция для перевода средств
-async def transfer_money(from_user_id, to_user_id, amount):
-    async with aiosqlite.connect("casino.db") as db:
-        try:
-            await db.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (amount, from_user_id))
-            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, to_user_id))
-            await db.commit()
-            return True
-        except:
-            await db.rollback()
-            return False
+async def get_top_players(page=1, per_page=10):
+    await leaderboard.ensure_loaded()
+    return leaderboard.page(page, per_page)
 
-# Функция для обработки команды /miniapp
-async def miniapp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    miniapp_url = f"https://your-domain.com/miniapp?user_id={user_id}"
-    await update.message.reply_text(
-        f"🎰 Откройте мини-приложение казино:\n{miniapp_url}",
-        reply_markup={
-            "inline_keyboard": [[{
-                "text": "Открыть мини-приложение",
-                "web_app": {"url": miniapp_url}
-            }]]
-        }
-    )
+# Функция для перевода средств по нику получателя; ошибки - storage.TransferError
+async def transfer_money(from_user_id, recipient, amount):
+    sender, to_user_id, balance = await storage.transfer(from_user_id, recipient, amount)
+    balance_changed(from_user_id, sender)
+    balance_changed(to_user_id, balance)
+    return sender
 
-# Функция для запуска бота в отдельном потоке
-def run_bot():
-    if not hasattr(st.session_state, 'bot_running'):
-        def bot_main():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                application = Application.builder().token(os.getenv("BOT_TOKEN")).build()
-                application.add_handler(CommandHandler("miniapp", miniapp_command))
-                loop.run_until_complete(application.initialize())
-                loop.run_until_complete(application.start())
-                loop.run_until_complete(application.run_polling())
-            except Exception as e:
-                print(f"Ошибка в боте: {str(e)}")
-        
-        bot_thread = threading.Thread(target=bot_main, daemon=True)
-        bot_thread.start()
-        st.session_state.bot_running = True
+# Подписи операций в истории
+TRANSACTION_KINDS = {
+    storage.TX_BET: "🎲 Ставка",
+    storage.TX_AUTOPLAY: "🔁 Автоигра",
+    storage.TX_TRANSFER: "💸 Перевод",
+    storage.TX_ADJUST: "🪙 Начисление",
+}
+
+# Страница истории; курсоры открытых страниц лежат в st.session_state
+async def get_history(user_id, before=None):
+    page = history_cache.get((user_id, before))
+    if page is None:
+        page = await history.history(user_id, before=before)
+        history_cache.set((user_id, before), page)
+    return page
 
-# Запуск бота в отдельном потоке
-run_bot()
+def history_cursor():
+    pages = st.session_state.setdefault("history_pages", [None])
+    return pages[-1]
+
+def history_next_page(cursor):
+    st.session_state.history_pages.append(cursor)
+
+def history_previous_page():
+    if len(st.session_state.history_pages) > 1:
+        st.session_state.history_pages.pop()
+
+# Анимация рулетки выполняется в браузере: сервер сразу отдает итоговое
+# число и результат, а кадры с промежуточными числами рисует JS
+ROULETTE_ANIMATION = """
+<div id="roulette" style="font-family: sans-serif; color: #FFFFFF; font-size: 20px;">
+    <div id="number">🎲 Выпало: ?</div>
+    <div id="result" style="margin-top: 8px; visibility: hidden;"></div>
+</div>
+<script>
+    const finalNumber = %(number)s;
+    const result = %(result)s;
+    const number = document.getElementById("number");
+    const outcome = document.getElementById("result");
+    let frame = 0;
+    const timer = setInterval(() => {
+        if (frame++ < 10) {
+            number.textContent = "🎲 Выпало: " + (1 + Math.floor(Math.random() * 36));
+            return;
+        }
+        clearInterval(timer);
+        number.textContent = "🎲 Выпало: " + finalNumber;
+        outcome.textContent = result.text;
+        outcome.style.color = result.color;
+        outcome.style.visibility = "visible";
+    }, 200);
+</script>
+"""
+
+def show_roulette_animation(final_number, text, won):
+    components.html(ROULETTE_ANIMATION % {
+        "number": final_number,
+        "result": json.dumps({"text": text, "color": "#4CAF50" if won else "#EF5350"}),
+    }, height=80)
 
 # Основной интерфейс
 def main():
@@ -245,7 +308,7 @@ def main():
                 
                 if login_submitted:
                     try:
-                        user = asyncio.run(authenticate_user(login_username, login_password))
+                        user = bridge.run(authenticate_user(login_username, login_password))
                         if user:
                             st.session_state.user_data = {
                                 'id': user['user_id'],
@@ -281,7 +344,7 @@ def main():
                         elif len(reg_password) < 6:
                             st.error("Пароль должен содержать минимум 6 символов")
                         else:
-                            success = asyncio.run(register_user(reg_username, reg_password, reg_first_name, reg_last_name))
+                            success = bridge.run(register_user(reg_username, reg_password, reg_first_name, reg_last_name))
                             if success:
                                 st.success("Регистрация успешна! Теперь вы можете войти.")
                             else:
@@ -295,18 +358,19 @@ def main():
         
         # Кнопка выхода
         if st.button("Выйти"):
-            st.session_state.is_logged_in = False
-            st.session_state.user_data = None
-            # Удаляем файл сессии при выходе
-            try:
-                os.remove('session.json')
-            except FileNotFoundError:
-                pass
+            clear_session_state()
             st.rerun()
         
-        # Получаем баланс пользователя
+        # Получаем баланс пользователя, топ игроков и историю одновременно
         try:
-            balance = asyncio.run(get_user_balance(user_id))
+            balance, top_players, transactions = bridge.gather(
+                get_user_balance(user_id),
+                get_top_players(st.session_state.get("top_page", 1)),
+                get_history(user_id, before=history_cursor()),
+                return_exceptions=True,
+            )
+            if isinstance(balance, Exception):
+                raise balance
             
             # Отображаем профиль пользователя
             col1, col2 = st.columns([1, 3])
@@ -333,7 +397,7 @@ def main():
                 st.subheader(f"💰 Баланс: {balance} монет")
             
             # Создаем вкладки
-            tab1, tab2, tab3 = st.tabs(["🎲 Рулетка", "📊 Топ игроков", "💸 Перевод"])
+            tab1, tab2, tab3, tab4 = st.tabs(["🎲 Рулетка", "📊 Топ игроков", "💸 Перевод", "📜 История"])
             
             with tab1:
                 st.header("🎲 Игра в рулетку")
@@ -344,30 +408,34 @@ def main():
                     if len(numbers) != 3:
                         st.error("Пожалуйста, выберите 3 числа!")
                     else:
-                        # Анимация рулетки
-                        placeholder = st.empty()
-                        for i in range(10):
-                            random_number = random.randint(1, 36)
-                            placeholder.write(f"🎲 Выпало: {random_number}")
-                            time.sleep(0.2)
-                        
-                        final_number = random.randint(1, 36)
-                        placeholder.write(f"🎲 Выпало: {final_number}")
-                        
-                        if final_number in numbers:
-                            winnings = bet * 36
-                            st.success(f"Поздравляем! Вы выиграли {winnings} монет!")
-                            asyncio.run(update_balance(user_id, winnings))
+                        # Результат считается и записывается сразу, анимация идет в браузере.
+                        # Движок с numpy импортируется при первом спине, а не при запуске
+                        from engine import engine
+                        final_number, payout = engine.roulette(bet, numbers)
+                        new_balance = bridge.run(settle_bet(user_id, bet, payout))
+                        if new_balance is None:
+                            st.error("У вас недостаточно средств!")
+                        elif payout > 0:
+                            show_roulette_animation(
+                                final_number, f"Поздравляем! Вы выиграли {payout} монет! Баланс: {new_balance} монет", True
+                            )
                         else:
-                            st.error("К сожалению, вы проиграли!")
-                            asyncio.run(update_balance(user_id, -bet))
+                            show_roulette_animation(
+                                final_number, f"К сожалению, вы проиграли! Баланс: {new_balance} монет", False
+                            )
             
             with tab2:
                 st.header("📊 Топ игроков")
                 try:
-                    top_players = asyncio.run(get_top_players())
-                    for i, player in enumerate(top_players, 1):
-                        st.write(f"{i}. {player['username']} - {player['balance']} монет")
+                    st.number_input("Страница", min_value=1, value=1, key="top_page")
+                    if isinstance(top_players, Exception):
+                        raise top_players
+                    for player in top_players:
+                        name = player['username'] or "Игрок Telegram"
+                        st.write(f"{player['rank']}. {name} - {player['balance']} монет")
+                    rank = leaderboard.rank(user_id)
+                    if rank is not None:
+                        st.write(f"Ваше место: {rank} из {len(leaderboard)}")
                 except Exception as e:
                     st.error(f"Ошибка при загрузке топа игроков: {str(e)}")
             
@@ -378,32 +446,43 @@ def main():
                 
                 if st.button("Перевести"):
                     try:
-                        async def process_transfer():
-                            async with aiosqlite.connect("casino.db") as db:
-                                db.row_factory = sqlite3.Row
-                                cursor = await db.execute("SELECT * FROM users WHERE username = ?", (recipient,))
-                                recipient_data = await cursor.fetchone()
-                                await cursor.close()
-                                
-                                if recipient_data:
-                                    if await transfer_money(user_id, recipient_data['user_id'], amount):
-                                        st.success(f"Успешно переведено {amount} монет пользователю {recipient}")
-                                    else:
-                                        st.error("Ошибка при переводе средств")
-                                else:
-                                    st.error("Пользователь не найден")
-                        
-                        asyncio.run(process_transfer())
+                        # Поиск получателя, проверка средств и перевод - одна транзакция
+                        bridge.run(transfer_money(user_id, recipient, amount))
+                        st.success(f"Успешно переведено {amount} монет пользователю {recipient}")
+                    except storage.TransferError as e:
+                        st.error(str(e))
                     except Exception as e:
                         st.error(f"Произошла ошибка при переводе: {str(e)}")
+
+            with tab4:
+                st.header("📜 История операций")
+                try:
+                    if isinstance(transactions, Exception):
+                        raise transactions
+                    entries, next_cursor = transactions
+                    if not entries:
+                        st.write("Операций пока нет")
+                    for entry in entries:
+                        when = time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(entry["ts"]))
+                        label = TRANSACTION_KINDS.get(entry["kind"], entry["kind"])
+                        st.write(f"{when} · {label} · {entry['amount']:+d} монет")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.button("← Новее", disabled=len(st.session_state.history_pages) == 1,
+                                  on_click=history_previous_page)
+                    with col2:
+                        st.button("Старее →", disabled=next_cursor is None,
+                                  on_click=history_next_page, args=(next_cursor,))
+                except Exception as e:
+                    st.error(f"Ошибка при загрузке истории: {str(e)}")
         except Exception as e:
             st.error(f"Произошла ошибка при загрузке данных: {str(e)}")
-            st.session_state.is_logged_in = False
-            st.session_state.user_data = None
+            clear_session_state()
             st.rerun()
 
-# Стилизация
-st.markdown("""
+# Стилизация: элементы страницы, которые не выведены в прогоне, Streamlit
+# удаляет, поэтому стили выводятся при каждом прогоне одной готовой строкой
+STYLES = """
 <style>
     .stApp {
         background-color: #2E2E2E;
@@ -459,7 +538,26 @@ st.markdown("""
         color: #FFFFFF;
     }
 </style>
-""", unsafe_allow_html=True) 
+"""
+
+# Показ времени выполнения скрипта и запросов к базе (SHOW_TIMINGS=1)
+SHOW_TIMINGS = os.getenv("SHOW_TIMINGS") == "1"
+
+def show_timings(started):
+    db = bridge.metrics()
+    cache = balance_cache.metrics()
+    st.sidebar.caption(
+        f"⏱ Скрипт: {(time.perf_counter() - started) * 1000:.1f} мс · "
+        f"запросов к базе: {db['calls']}, в среднем {db['avg_time'] * 1000:.2f} мс, "
+        f"максимум {db['max_time'] * 1000:.2f} мс · "
+        f"кэш балансов: {cache['hits']} попаданий, {cache['misses']} промахов"
+    )
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    rerun_started = time.perf_counter()
+    start_runtime()
+    init_session()
+    st.markdown(STYLES, unsafe_allow_html=True)
+    main()
+    if SHOW_TIMINGS:
+        show_timings(rerun_started)
\ No newline at end of file
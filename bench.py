@@ -0,0 +1,1628 @@
+import argparse
+import asyncio
+import collections
+import gc
+import json
+import logging
+import multiprocessing
+import statistics
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import aiosqlite
+from aiohttp import ClientSession, web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
+
+import simulation
+import credentials
+import fsm
+import history
+import instrumentation
+import migrations
+import sessions
+import storage
+import ui
+import webhook
+from bridge import AsyncBridge
+from engine import PAIR, GameEngine, SlotSpin
+from fsm import BetStates
+from leaderboard import Leaderboard
+from ledger import SpinLedger
+from throttling import SendScheduler, TokenBucketLimiter
+
+
+# Временная база с пользователями бота; с migrate - сразу в актуальной схеме
+async def make_db(path, users, balance=1000, migrate=True):
+    async with aiosqlite.connect(path) as db:
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                balance INTEGER DEFAULT 1000
+            )
+        """)
+        await db.executemany(
+            "INSERT INTO users (user_id, balance) VALUES (?, ?)",
+            ((user_id, balance) for user_id in range(1, users + 1)),
+        )
+        await db.commit()
+    if migrate:
+        use_db(path)
+        await migrations.migrate()
+        await storage.close_pool()
+
+
+# Копия рабочей базы для нагрузочных тестов: backup API читает
+# согласованный снимок вместе с WAL и ничего не пишет в исходную базу
+def copy_db(source, target):
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def use_db(path, pool_size=storage.POOL_SIZE):
+    storage.DB_PATH = path
+    storage.POOL_SIZE = pool_size
+    # Новая база: схему нужно проверить заново, кэш Telegram id к ней не относится
+    migrations._current = False
+    storage._telegram_users.clear()
+
+
+async def run_players(spin, players, spins):
+    # Каждый игрок делает spins ставок подряд, игроки играют одновременно
+    async def player(user_id):
+        for _ in range(spins):
+            await spin(user_id, random.choice((-10, 10)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(player(user_id) for user_id in range(1, players + 1)))
+    return players * spins / (time.perf_counter() - started)
+
+
+# Спин как раньше в process_bet: SELECT и UPDATE в двух отдельных соединениях
+def connect_per_call_spin(path):
+    async def spin(user_id, delta):
+        async with aiosqlite.connect(path) as db:
+            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                await cursor.fetchone()
+        async with aiosqlite.connect(path) as db:
+            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (delta, user_id))
+            await db.commit()
+    return spin
+
+
+async def bench_ledger(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, args.players)
+        use_db(path, args.pool_size)
+
+        rate = await run_players(connect_per_call_spin(path), args.players, args.spins)
+        print(f"connect на каждый вызов: {rate:10.0f} спинов/с")
+
+        async def pooled_spin(user_id, delta):
+            await storage.get_balance(user_id)
+            await storage.apply_delta(user_id, delta)
+
+        rate = await run_players(pooled_spin, args.players, args.spins)
+        print(f"пул соединений:          {rate:10.0f} спинов/с")
+
+        ledger = SpinLedger(args.flush_ms, args.batch, args.queue)
+        await ledger.start()
+
+        async def ledger_spin(user_id, delta):
+            await storage.get_balance(user_id)
+            await ledger.record(user_id, max(-delta, 0), delta)
+
+        rate = await run_players(ledger_spin, args.players, args.spins)
+        await ledger.stop()
+        print(f"журнал с групповым коммитом: {rate:6.0f} спинов/с  {ledger.metrics()}")
+        print(f"пул: {storage.pool_metrics()}")
+        await storage.close_pool()
+
+
+# Проверка и списание как раньше: SELECT, затем отдельный UPDATE
+async def check_then_update(user_id, bet, payout):
+    balance = await storage.get_balance(user_id)
+    if balance < bet:
+        return None
+    await asyncio.sleep(0)  # бросок барабанов между проверкой и списанием
+    return await storage.apply_delta(user_id, payout)
+
+
+async def stress_settle(name, settle, users, spins, balance):
+    async with storage.connection() as db:
+        await db.execute("UPDATE users SET balance = ?", (balance,))
+        await db.commit()
+
+    bets = []
+    for _ in range(spins):
+        bet = random.randint(1, balance // 2)
+        bets.append((random.randint(1, users), bet, random.choice((bet * 3, bet, -bet, -bet, -bet, -bet))))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(settle(*spin) for spin in bets))
+    elapsed = time.perf_counter() - started
+
+    # Ожидаемый баланс: начальный плюс выплаты по принятым ставкам
+    expected = dict.fromkeys(range(1, users + 1), balance)
+    for (user_id, _, payout), result in zip(bets, results):
+        if result is not None:
+            expected[user_id] += payout
+
+    async with storage.connection() as db:
+        async with db.execute("SELECT user_id, balance FROM users") as cursor:
+            actual = dict(await cursor.fetchall())
+
+    lost = sum(1 for user_id in expected if expected[user_id] != actual[user_id])
+    negative = sum(1 for value in actual.values() if value < 0)
+    accepted = sum(1 for result in results if result is not None)
+    print(f"{name:28} {spins / elapsed:8.0f} спинов/с  принято {accepted}/{spins}  "
+          f"расхождений {lost}  отрицательных балансов {negative}")
+    return lost == 0 and negative == 0
+
+
+async def bench_settle(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, args.users)
+        use_db(path, args.pool_size)
+
+        ok = await stress_settle("settle_bet", storage.settle_bet, args.users, args.spins, args.balance)
+
+        ledger = SpinLedger()
+        await ledger.start()
+        ok = await stress_settle("журнал спинов", ledger.record, args.users, args.spins, args.balance) and ok
+        await ledger.stop()
+
+        # Старый путь для сравнения: гонка приводит к отрицательным балансам
+        await stress_settle("SELECT + UPDATE (старый путь)", check_then_update, args.users, args.spins, args.balance)
+        await storage.close_pool()
+
+    if not ok:
+        raise SystemExit("Обнаружены потерянные обновления или отрицательные балансы")
+
+
+# p50/p99 в миллисекундах
+# Квантили по самой выборке: при методе по умолчанию (exclusive) p99
+# небольшой выборки экстраполируется и может оказаться больше максимума
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return f"p50 {cuts[49] * 1e3:.3f} мс, p99 {cuts[98] * 1e3:.3f} мс"
+
+
+def timeit(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+async def atimeit(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - started) / repeat
+
+
+async def bench_leaderboard(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, 0)
+        async with aiosqlite.connect(path) as db:
+            # Миграции создают индекс по балансу; первый замер - без него
+            await db.execute("DROP INDEX idx_users_balance")
+            await db.executemany(
+                "INSERT INTO users (user_id, username, balance) VALUES (?, ?, ?)",
+                ((user_id, f"user{user_id}", random.randint(0, 1_000_000)) for user_id in range(1, args.users + 1)),
+            )
+            await db.commit()
+        use_db(path)
+
+        async def top_query():
+            await storage.top_n(10)
+
+        print(f"пользователей: {args.users}")
+        print(f"ORDER BY без индекса:    {await atimeit(top_query, 3) * 1e6:12.1f} мкс")
+        async with storage.connection() as db:
+            await db.execute(storage.SQL_BALANCE_INDEX)
+            await db.commit()
+        print(f"ORDER BY по индексу:     {await atimeit(top_query, 100) * 1e6:12.1f} мкс")
+
+        board = Leaderboard()
+        started = time.perf_counter()
+        await board.ensure_loaded()
+        print(f"загрузка таблицы лидеров: {(time.perf_counter() - started) * 1e3:11.1f} мс")
+        print(f"top(10):                 {timeit(lambda: board.top(10), 10000) * 1e6:12.1f} мкс")
+        print(f"page(500):               {timeit(lambda: board.page(500), 10000) * 1e6:12.1f} мкс")
+        ids = [random.randint(1, args.users) for _ in range(10000)]
+        print(f"rank():                  {timeit(lambda: board.rank(random.choice(ids)), 10000) * 1e6:12.1f} мкс")
+        print(f"update():                "
+              f"{timeit(lambda: board.update(random.choice(ids), random.randint(0, 1_000_000)), 10000) * 1e6:12.1f} мкс")
+        await storage.close_pool()
+
+
+async def bench_engine(args):
+    engine = GameEngine(args.seed)
+    chunks = -(-args.spins // args.chunk)
+
+    started = time.perf_counter()
+    for _ in range(chunks):
+        engine.spin_many(args.chunk, 10)
+    rate = chunks * args.chunk / (time.perf_counter() - started)
+    print(f"слоты, spin_many:     {rate:14.0f} спинов/с")
+
+    started = time.perf_counter()
+    for _ in range(chunks):
+        engine.roulette_many(args.chunk, 10, (7, 17, 27))
+    rate = chunks * args.chunk / (time.perf_counter() - started)
+    print(f"рулетка, roulette_many: {rate:12.0f} спинов/с")
+
+    repeat = 100_000
+    started = time.perf_counter()
+    for _ in range(repeat):
+        engine.spin(10)
+    print(f"слоты, spin по одному: {repeat / (time.perf_counter() - started):13.0f} спинов/с")
+
+
+async def bench_rtp(args):
+    numbers = tuple(args.numbers)
+    games = {
+        "slots": ((), simulation.exact_slots()),
+        "roulette": (numbers, simulation.exact_roulette(numbers)),
+    }
+    report = {"spins": args.spins, "seed": args.seed, "games": {}}
+    failures = []
+
+    for game, (game_numbers, exact) in games.items():
+        result = simulation.simulate_rtp(
+            game, args.spins, args.chunk, args.workers, args.seed, game_numbers,
+        )
+        result["ruin"] = simulation.simulate_ruin(
+            game, args.paths, args.horizon, args.bankroll, workers=args.workers, seed=args.seed, numbers=game_numbers,
+        )
+        result["exact"] = exact
+        report["games"][game] = result
+
+        low, high = result["rtp_ci95"]
+        print(f"{game}: RTP {result['rtp']:.5f} [{low:.5f}, {high:.5f}] (точно {exact['rtp']:.5f}), "
+              f"частота выигрыша {result['hit_frequency']:.5f}, дисперсия {result['variance']:.3f}, "
+              f"{result['throughput']['spins_per_second']:.0f} спинов/с")
+        for point in result["ruin"]["curve"]:
+            print(f"    разорение за {point['spins']:6} спинов: {point['ruin_probability']:.4f} "
+                  f"[{point['ci95'][0]:.4f}, {point['ci95'][1]:.4f}]")
+
+        # Математика: 95% интервал не покрывает точное значение в каждом
+        # двадцатом прогоне, поэтому проверка - отклонение не больше gate_z
+        # стандартных ошибок (при z=5 ложная тревога - примерно 1 на 1,7 млн)
+        z = abs(result["rtp"] - exact["rtp"]) / result["rtp_std_error"]
+        if z > args.gate_z:
+            failures.append(f"{game}: RTP {result['rtp']:.5f} отличается от точного {exact['rtp']:.5f} "
+                            f"на {z:.1f} стандартных ошибок")
+
+    # Скорость: сравнение с сохраненным прогоном
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for game, result in report["games"].items():
+            old = baseline["games"].get(game)
+            if old is None:
+                continue
+            rate = result["throughput"]["spins_per_second"]
+            old_rate = old["throughput"]["spins_per_second"]
+            if rate < old_rate * (1 - args.tolerance):
+                failures.append(f"{game}: {rate:.0f} спинов/с против {old_rate:.0f} в базовом прогоне")
+
+    report["failures"] = failures
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"результаты записаны в {args.output}")
+    if failures:
+        raise SystemExit("\n".join(failures))
+
+
+def bench_bridge(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        asyncio.run(make_db(path, args.users))
+        use_db(path)
+
+        async def create_index():
+            async with storage.connection() as db:
+                await db.execute(storage.SQL_BALANCE_INDEX)
+                await db.commit()
+
+        asyncio.run(create_index())
+        user_ids = [random.randint(1, args.users) for _ in range(args.reruns)]
+
+        # Один «перезапуск скрипта»: баланс и топ игроков, как в app.py main()
+        started = time.perf_counter()
+        for user_id in user_ids:
+            asyncio.run(storage.get_balance(user_id))
+            asyncio.run(storage.top_n(10))
+        per_call = (time.perf_counter() - started) / args.reruns
+
+        bridge = AsyncBridge()
+        started = time.perf_counter()
+        for user_id in user_ids:
+            bridge.run(storage.get_balance(user_id))
+            bridge.run(storage.top_n(10))
+        sequential = (time.perf_counter() - started) / args.reruns
+
+        started = time.perf_counter()
+        for user_id in user_ids:
+            bridge.gather(storage.get_balance(user_id), storage.top_n(10))
+        concurrent = (time.perf_counter() - started) / args.reruns
+
+        print(f"asyncio.run на каждый запрос: {per_call * 1e3:8.3f} мс на перезапуск")
+        print(f"мост, запросы по очереди:     {sequential * 1e3:8.3f} мс на перезапуск")
+        print(f"мост, запросы одновременно:   {concurrent * 1e3:8.3f} мс на перезапуск")
+        bridge.run(storage.close_pool())
+        bridge.stop()
+
+
+async def bench_sessions(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, 0)
+        use_db(path)
+        async with storage.connection() as db:
+            await db.execute(sessions.SQL_CREATE_SESSIONS)
+            await db.execute(sessions.SQL_SESSIONS_INDEX)
+            await db.commit()
+
+        store = sessions.SessionStore()
+        user_data = {"id": 1, "username": "user", "first_name": None, "last_name": None}
+
+        # Вход: создание сессий
+        tokens, samples = [], []
+        for user_id in range(args.sessions):
+            started = time.perf_counter()
+            tokens.append(await store.create(dict(user_data, id=user_id)))
+            samples.append(time.perf_counter() - started)
+        print(f"вход (создание сессии), {args.sessions} сессий: {percentiles(samples)}")
+
+        # Перезапуск скрипта: поиск сессии, попадание в кэш
+        samples = []
+        for _ in range(args.lookups):
+            token = random.choice(tokens)
+            started = time.perf_counter()
+            await store.get(token)
+            samples.append(time.perf_counter() - started)
+        print(f"поиск сессии из кэша:      {percentiles(samples)}  {store.metrics()}")
+
+        # Холодный поиск после перезапуска процесса
+        cold = sessions.SessionStore()
+        samples = []
+        for token in random.sample(tokens, min(args.lookups, len(tokens))):
+            started = time.perf_counter()
+            await cold.get(token)
+            samples.append(time.perf_counter() - started)
+        print(f"поиск сессии в базе:       {percentiles(samples)}")
+
+        # Старый путь: перезапись и чтение общего session.json
+        session_file = os.path.join(tmp, "session.json")
+        samples = []
+        for _ in range(args.lookups):
+            started = time.perf_counter()
+            with open(session_file, "w") as f:
+                json.dump({"is_logged_in": True, "user_data": user_data}, f)
+            with open(session_file) as f:
+                json.load(f)
+            samples.append(time.perf_counter() - started)
+        print(f"session.json (старый путь): {percentiles(samples)}")
+        await storage.close_pool()
+
+
+def bench_passwords(args):
+    settings = [("scrypt", {"scrypt_n": 2 ** n}) for n in args.scrypt_log_n]
+    settings += [("pbkdf2-sha256", {"pbkdf2_iterations": i}) for i in args.pbkdf2_iterations]
+    workers = args.workers or os.cpu_count() or 1
+
+    print(f"ядер: {os.cpu_count()}, потоков в пуле: {workers}")
+    for scheme, params in settings:
+        hasher = credentials.PasswordHasher(scheme, **params)
+        stored = hasher.hash("correct horse")
+        cost = ", ".join(f"{key}={value}" for key, value in params.items())
+
+        # Вход на одном ядре
+        started = time.perf_counter()
+        for _ in range(args.logins):
+            hasher.verify("correct horse", stored)
+        per_core = args.logins / (time.perf_counter() - started)
+
+        # Вход через пул потоков, как в приложении
+        with ThreadPoolExecutor(workers) as pool:
+            started = time.perf_counter()
+            list(pool.map(hasher.verify, ["correct horse"] * args.logins * workers, [stored] * args.logins * workers))
+            pooled = args.logins * workers / (time.perf_counter() - started)
+
+        print(f"{scheme:14} {cost:26} {per_core:8.1f} входов/с на ядро, {pooled:8.1f} входов/с в пуле "
+              f"({1000 / per_core:.1f} мс на вход)")
+
+
+SQL_CREATE_APP_USERS = """
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        balance INTEGER DEFAULT 1000,
+        first_name TEXT,
+        last_name TEXT,
+        telegram_username TEXT
+    )
+"""
+
+
+# Регистрация как раньше: проверка имени, MAX(user_id), INSERT - три обращения
+async def register_old(db, username, password_hash):
+    async with db.execute("SELECT username FROM users WHERE username = ?", (username,)) as cursor:
+        if await cursor.fetchone():
+            return False
+    async with db.execute("SELECT MAX(user_id) FROM users") as cursor:
+        max_id = await cursor.fetchone()
+    await db.execute(
+        "INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)",
+        ((max_id[0] or 0) + 1, username, password_hash),
+    )
+    await db.commit()
+    return True
+
+
+async def bench_register(args):
+    password_hash = credentials.PasswordHasher(scrypt_n=2).hash("password")
+    for name in ("старый путь (3 запроса)", "create_user (1 запрос)", "register_many"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            async with aiosqlite.connect(path) as db:
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute(SQL_CREATE_APP_USERS)
+                await db.commit()
+            use_db(path)
+            usernames = [f"user{i}" for i in range(args.users)]
+
+            started = time.perf_counter()
+            if name.startswith("старый"):
+                async with storage.connection() as db:
+                    for username in usernames:
+                        await register_old(db, username, password_hash)
+            elif name.startswith("create_user"):
+                for username in usernames:
+                    await storage.create_user(username, password_hash)
+            else:
+                await storage.register_many(
+                    (username, password_hash, None, None, None, 1000) for username in usernames
+                )
+            elapsed = time.perf_counter() - started
+            print(f"{name:26} {args.users} пользователей за {elapsed:7.2f} с ({args.users / elapsed:9.0f} в секунду)")
+            await storage.close_pool()
+
+
+# Старт как раньше: DDL таблиц и индексов при каждом запуске
+async def init_db_old(db):
+    await db.execute(SQL_CREATE_APP_USERS.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS"))
+    await db.execute(storage.SQL_BALANCE_INDEX)
+    await db.execute(sessions.SQL_CREATE_SESSIONS)
+    await db.execute(sessions.SQL_SESSIONS_INDEX)
+    await db.commit()
+
+
+async def bench_migrate(args):
+    for shape in ("бот", "веб-приложение"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            if shape == "бот":
+                await make_db(path, args.users, migrate=False)
+            else:
+                async with aiosqlite.connect(path) as db:
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute(SQL_CREATE_APP_USERS)
+                    await db.executemany(
+                        "INSERT INTO users (username, password) VALUES (?, ?)",
+                        ((f"user{i}", "!") for i in range(args.users)),
+                    )
+                    await db.commit()
+            use_db(path)
+
+            # Холодная миграция: перестройка таблицы и индексы
+            migrations._current = False
+            started = time.perf_counter()
+            await migrations.migrate()
+            print(f"{shape:15} миграция {args.users} пользователей: {time.perf_counter() - started:7.2f} с")
+            await storage.close_pool()
+
+            # Повторный старт: новое соединение и проверка версии против DDL на каждый запуск
+            async def warm_start():
+                migrations._current = False
+                await migrations.migrate()
+                await storage.close_pool()
+
+            async def old_start():
+                async with storage.connection() as db:
+                    await init_db_old(db)
+                await storage.close_pool()
+
+            print(f"{'':15} старт с user_version: {await atimeit(warm_start, args.starts) * 1e3:.3f} мс")
+            print(f"{'':15} старт с DDL:          {await atimeit(old_start, args.starts) * 1e3:.3f} мс")
+
+
+# Сессия Bot API без сети: отвечает сразу (или через api_ms) и сообщает
+# о каждом отправленном сообщении, чтобы измерять задержку до ответа
+class FakeSession(BaseSession):
+    def __init__(self, on_send=None, api_ms=0.0, serialize=False):
+        super().__init__()
+        self.on_send = on_send
+        self.api_delay = api_ms / 1000
+        self.serialize = serialize
+        self.calls = collections.Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        # Тело запроса, как его собирает настоящая сессия перед отправкой
+        if self.serialize:
+            AiohttpSession.build_form_data(self, bot, method)
+        if self.api_delay:
+            await asyncio.sleep(self.api_delay)
+        chat_id = getattr(method, "chat_id", None)
+        if self.on_send is not None:
+            self.on_send(chat_id, getattr(method, "text", None))
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(
+                message_id=1, date=datetime.now(), text=method.text,
+                chat=Chat(id=chat_id or 0, type="private"),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+# Поддельные обновления Telegram: нажатие "Крутить" и сообщение со ставкой
+def fake_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def fake_callback(update_id, user_id, data):
+    chat = {"id": user_id, "type": "private"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": fake_user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": 1, "date": 0, "chat": chat, "text": "🎰"},
+    }}
+
+
+def fake_message(update_id, user_id, text):
+    chat = {"id": user_id, "type": "private"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": chat, "from": fake_user(user_id), "text": text,
+    }}
+
+
+# Бот из main.py на временной базе и с сессией без сети
+# С limits=False защита от флуда отключена: замеряется сам конвейер обработки
+def load_bot(path, on_send=None, api_ms=0.0, session=None, limits=False):
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    use_db(path)
+    import main
+    main.bot.session = session or FakeSession(on_send, api_ms)
+    if limits:
+        main.throttling.limiter = TokenBucketLimiter()
+        main.send_scheduler = SendScheduler()
+        main.bot.session.middleware(main.send_scheduler)
+    else:
+        main.throttling.limiter = TokenBucketLimiter(rate=1e9, burst=1e9)
+    main.bot.session.middleware(main.prepared_markup)
+    # main.py включает INFO; журнал каждого обновления искажает замер
+    logging.getLogger().setLevel(logging.CRITICAL if limits else logging.WARNING)
+    return main
+
+
+async def bench_webhook(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        waiting = {}
+        latencies = []
+
+        # Ответ бота пользователю завершает его текущий шаг
+        def on_send(chat_id, text):
+            step = waiting.pop(chat_id, None)
+            if step is not None and not step[0].done():
+                step[0].set_result(None)
+                if text and text.startswith("🎰 Результат"):
+                    latencies.append(time.perf_counter() - step[1])
+
+        main = load_bot(path, on_send, args.api_ms)
+        app = webhook.build_app(
+            main.dp, main.bot, concurrency=args.concurrency, max_pending=args.max_pending, secret_token=None,
+        )
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}"
+        update_ids = iter(range(1, 1 << 62))
+        rejected = 0
+
+        async with ClientSession() as http:
+            async def post(update, user_id):
+                nonlocal rejected
+                loop = asyncio.get_running_loop()
+                delay = 0.1
+                while True:
+                    step = waiting[user_id] = (loop.create_future(), time.perf_counter())
+                    async with http.post(url, json=update) as response:
+                        if response.status == 200:
+                            break
+                    # 503: обработчик перегружен, Telegram повторяет запрос с нарастающей паузой
+                    rejected += 1
+                    waiting.pop(user_id, None)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 2.0)
+                await asyncio.wait_for(step[0], 30)
+
+            # Пользователь жмет "Крутить", дожидается запроса ставки и отправляет ее
+            async def player(user_id):
+                for _ in range(args.spins):
+                    await post(fake_callback(next(update_ids), user_id, "spin_slots"), user_id)
+                    await post(fake_message(next(update_ids), user_id, str(args.bet)), user_id)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(player(user_id) for user_id in range(1, args.users + 1)))
+            elapsed = time.perf_counter() - started
+
+        updates = args.users * args.spins * 2
+        print(f"пользователей {args.users}, спинов на пользователя {args.spins}, ожидание API {args.api_ms} мс")
+        print(f"обновлений/с: {updates / elapsed:9.0f}, спинов/с: {len(latencies) / elapsed:9.0f}")
+        print(f"ставка -> ответ: {percentiles(latencies)}")
+        print(f"отклонено с 503: {rejected}")
+        # Остановка дожидается обновлений, которые еще дорабатывают после ответа
+        await runner.cleanup()
+        print(f"обработчик: {app['webhook_handler'].metrics()}")
+        print(f"журнал: {main.ledger.metrics()}")
+        print(f"вызовы API: {dict(main.bot.session.calls)}")
+
+
+# Память на пользователя, который нажал "Крутить" и ушел
+async def fsm_memory(name, set_state, users, bot_id=123456):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for user_id in range(10 ** 9, 10 ** 9 + users):
+        await set_state(StorageKey(bot_id, user_id, user_id))
+    elapsed = time.perf_counter() - started
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:28} {used / users:7.1f} байт на пользователя, {used / 2 ** 20:7.1f} МиБ, "
+          f"{users / elapsed:9.0f} записей/с")
+
+
+async def bench_fsm(args):
+    print(f"пользователей в состоянии ожидания ставки: {args.users}")
+    states = {}
+
+    async def old_dict(key):
+        states[key.user_id] = "waiting_for_bet"
+    await fsm_memory("словарь user_states", old_dict, args.users)
+    states.clear()
+
+    aiogram_storage = MemoryStorage()
+    await fsm_memory("aiogram MemoryStorage", lambda key: aiogram_storage.set_state(key, BetStates.waiting_for_bet),
+                     args.users)
+    del aiogram_storage
+
+    memory = fsm.TTLMemoryStorage(maxsize=args.users)
+    await fsm_memory("TTLMemoryStorage", lambda key: memory.set_state(key, BetStates.waiting_for_bet), args.users)
+    del memory
+
+    # Ушедшие пользователи забываются через ttl
+    memory = fsm.TTLMemoryStorage(ttl=args.ttl)
+    for user_id in range(1, 100_001):
+        await memory.set_state(StorageKey(123456, user_id, user_id), BetStates.waiting_for_bet)
+    await asyncio.sleep(args.ttl)
+    print(f"через {args.ttl} с удалено устаревших: {await memory.purge_expired()}, осталось {len(memory)}")
+
+    # Общая база: размер на диске и задержка операций
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        use_db(path)
+        await migrations.migrate()
+        sqlite_storage = fsm.SQLiteStorage()
+        keys = [StorageKey(123456, user_id, user_id) for user_id in range(1, args.sqlite_users + 1)]
+        writes = []
+        for key in keys:
+            started = time.perf_counter()
+            await sqlite_storage.set_state(key, BetStates.waiting_for_bet)
+            writes.append(time.perf_counter() - started)
+        reads = []
+        for key in random.sample(keys, min(len(keys), 20_000)):
+            started = time.perf_counter()
+            await sqlite_storage.get_state(key)
+            reads.append(time.perf_counter() - started)
+        async with storage.connection() as db:
+            await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await storage.close_pool()
+        size = os.path.getsize(path)
+        print(f"SQLiteStorage ({args.sqlite_users}): {size / args.sqlite_users:.1f} байт на диске на пользователя")
+        print(f"  запись: {percentiles(writes)}")
+        print(f"  чтение: {percentiles(reads)}")
+
+
+# Bot API с ограничениями Telegram: сверх лимита чата или общего лимита
+# за последнюю секунду запрос получает 429 с retry_after
+class RateLimitedSession(FakeSession):
+    def __init__(self, global_rate=30, chat_burst=3, retry_after=1):
+        super().__init__()
+        self.global_rate = global_rate
+        self.chat_burst = chat_burst
+        self.retry_after = retry_after
+        self.too_many = 0
+        self._sent = collections.deque()
+        self._chats = collections.defaultdict(collections.deque)
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            now = time.monotonic()
+            for sent in (self._sent, self._chats[chat_id]):
+                while sent and sent[0] <= now - 1:
+                    sent.popleft()
+            if len(self._sent) >= self.global_rate or len(self._chats[chat_id]) >= self.chat_burst:
+                self.too_many += 1
+                raise TelegramRetryAfter(method, "Too Many Requests", self.retry_after)
+            self._sent.append(now)
+            self._chats[chat_id].append(now)
+        return await super().make_request(bot, method, timeout)
+
+
+async def bench_throttle(args):
+    for limits in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = RateLimitedSession(retry_after=args.retry_after)
+            main = load_bot(os.path.join(tmp, "bench.db"), session=session, limits=limits)
+            await main.dp.emit_startup()
+            update_ids = iter(range(1, 1 << 62))
+            failed = collections.Counter()
+            latencies = []
+
+            async def feed(user_id, normal):
+                started = time.perf_counter()
+                try:
+                    await main.dp.feed_raw_update(main.bot, fake_callback(next(update_ids), user_id, "balance"))
+                except Exception:
+                    failed["игроки" if normal else "флудеры"] += 1
+                    return
+                if normal:
+                    latencies.append(time.perf_counter() - started)
+
+            # Флудер жмет "Баланс" rate раз в секунду, обычный игрок - раз в 2 секунды
+            async def user(user_id, rate, normal):
+                tasks = []
+                deadline = time.perf_counter() + args.duration
+                while time.perf_counter() < deadline:
+                    tasks.append(asyncio.create_task(feed(user_id, normal)))
+                    await asyncio.sleep(1 / rate)
+                await asyncio.gather(*tasks)
+
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(user(user_id, args.spam_rate, False) for user_id in range(1, args.spammers + 1)),
+                *(user(user_id, 0.5, True) for user_id in range(10_000, 10_000 + args.players)),
+            )
+            elapsed = time.perf_counter() - started
+            await main.dp.emit_shutdown()
+
+            print("с ограничениями" if limits else "без ограничений")
+            print(f"  флудеров {args.spammers} x {args.spam_rate}/с, игроков {args.players}, {args.duration} с; "
+                  f"прошло {elapsed:.1f} с")
+            print(f"  вызовов API: {sum(session.calls.values())}, 429 от Telegram: {session.too_many}, "
+                  f"обновлений с ошибкой: {dict(failed)}")
+            if latencies:
+                print(f"  ответ обычному игроку: {percentiles(latencies)}")
+            if limits:
+                print(f"  лимит пользователей: {main.throttling.limiter.metrics()}")
+                print(f"  планировщик отправки: {main.send_scheduler.metrics()}")
+
+
+async def bench_autoplay(args):
+    for mode in ("process_bet", "autoplay"):
+        with tempfile.TemporaryDirectory() as tmp:
+            played = 0
+
+            def on_send(chat_id, text):
+                nonlocal played
+                if text and text.startswith("🎰 Результат"):
+                    played += 1
+                elif text and text.startswith("🔁 Автоигра"):
+                    played += int(text.split()[2])
+
+            main = load_bot(os.path.join(tmp, "bench.db"), on_send)
+            await main.dp.emit_startup()
+            update_ids = iter(range(1, 1 << 62))
+            feed = main.dp.feed_raw_update
+
+            # Каждый спин - "Крутить" и сообщение со ставкой, либо одна команда на все спины
+            async def player(user_id):
+                if mode == "autoplay":
+                    await feed(main.bot, fake_message(next(update_ids), user_id, f"/autoplay {args.spins} {args.bet}"))
+                    return
+                for _ in range(args.spins):
+                    await feed(main.bot, fake_callback(next(update_ids), user_id, "spin_slots"))
+                    await feed(main.bot, fake_message(next(update_ids), user_id, str(args.bet)))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(player(user_id) for user_id in range(1, args.users + 1)))
+            elapsed = time.perf_counter() - started
+            calls = sum(main.bot.session.calls.values())
+            # Коммиты расчета: пачки журнала или по одному на автоигру
+            commits = main.ledger.batches if mode == "process_bet" else args.users
+            await main.dp.emit_shutdown()
+            print(f"{mode:12} {played} спинов за {elapsed:6.2f} с: {played / elapsed:8.0f} спинов/с, "
+                  f"{elapsed / played * 1e6:7.1f} мкс на спин, вызовов API на спин {calls / played:.3f}, "
+                  f"коммитов на спин {commits / played:.3f}")
+
+
+# Журнал операций на rows записей: у пользователя 1 - каждая сотая запись
+# (длинная история), остальные распределены случайно. Заполняется внутри
+# SQLite без журнала, индекс строится после заполнения.
+def fill_transactions(path, users, rows, started):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=DELETE")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("DROP INDEX idx_transactions_user_ts")
+    db.execute("""
+        WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n LIMIT ?)
+        INSERT INTO transactions (user_id, ts, kind, amount)
+        SELECT CASE WHEN x % 100 = 0 THEN 1 ELSE abs(random()) % ? + 1 END,
+               ? + x * 0.001, 'bet', abs(random()) % 21 - 10
+        FROM n
+    """, (rows, users, started))
+    db.commit()
+    db.execute("CREATE INDEX idx_transactions_user_ts ON transactions (user_id, ts)")
+    # Балансы сходятся с журналом
+    db.execute("CREATE TEMP TABLE sums (user_id INTEGER PRIMARY KEY, total INTEGER)")
+    db.execute("INSERT INTO sums SELECT user_id, SUM(amount) FROM transactions GROUP BY user_id")
+    db.execute("UPDATE users SET balance = balance + sums.total FROM sums WHERE sums.user_id = users.user_id")
+    db.commit()
+    db.execute("PRAGMA journal_mode=WAL")
+    db.close()
+
+
+# Снимки длинной истории пользователя 1, как если бы они делались по ходу:
+# каждые 10000 его операций
+async def add_past_snapshots():
+    async with storage.connection() as db:
+        await db.execute("""
+            INSERT OR IGNORE INTO balance_snapshots (user_id, tx_id, ts, balance)
+            SELECT user_id, id, ts, balance FROM (
+                SELECT user_id, id, ts, 1000 + SUM(amount) OVER (ORDER BY ts, id) AS balance,
+                       ROW_NUMBER() OVER (ORDER BY ts, id) AS number
+                FROM transactions WHERE user_id = 1
+            ) WHERE number % 10000 = 0
+        """)
+        await db.commit()
+
+
+async def bench_history(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, args.users)
+        use_db(path)
+        await migrations.migrate()
+        await storage.close_pool()
+        started = time.time() - args.rows * 0.001
+
+        t = time.perf_counter()
+        await asyncio.to_thread(fill_transactions, path, args.users, args.rows, started)
+        size = os.path.getsize(path)
+        print(f"журнал {args.rows} записей, {args.users} пользователей: заполнение {time.perf_counter() - t:.0f} с, "
+              f"{size / 2 ** 30:.2f} ГиБ ({size / args.rows:.1f} байт на запись)")
+
+        users = [random.randint(2, args.users) for _ in range(args.samples)]
+        samples = []
+        for user_id in users:
+            t = time.perf_counter()
+            await history.history(user_id)
+            samples.append(time.perf_counter() - t)
+        print(f"первая страница истории:           {percentiles(samples)}")
+
+        # Пользователь 1: rows / 100 записей; страница на глубине depth
+        depth = min(args.depth, args.rows // 100 - 100)
+        async with storage.connection() as db:
+            rows = await db.execute_fetchall(
+                "SELECT ts, id FROM transactions WHERE user_id = 1 ORDER BY ts DESC, id DESC LIMIT 1 OFFSET ?",
+                (depth - 1,),
+            )
+        cursor = (rows[0][0], rows[0][1])
+
+        async def keyset_page():
+            await history.history(1, before=cursor)
+
+        async def offset_page():
+            async with storage.connection() as db:
+                await db.execute_fetchall(
+                    "SELECT id, ts, kind, amount, counterparty FROM transactions WHERE user_id = 1 "
+                    "ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?",
+                    (history.HISTORY_PAGE_SIZE, depth),
+                )
+        print(f"страница на глубине {depth}: по ключу {await atimeit(keyset_page, 20) * 1e3:.3f} мс, "
+              f"OFFSET {await atimeit(offset_page, 3) * 1e3:.1f} мс")
+
+        # Запись ставки вместе с журналом
+        samples = []
+        for user_id in users[:args.writes]:
+            t = time.perf_counter()
+            await storage.settle_bet(user_id, 1, random.choice((-1, 1)))
+            samples.append(time.perf_counter() - t)
+        print(f"settle_bet с записью в журнал:     {percentiles(samples)}")
+
+        t = time.perf_counter()
+        count = await history.take_snapshots()
+        print(f"первые снимки балансов: {count} за {time.perf_counter() - t:.1f} с")
+        for user_id in users[:args.writes]:
+            await storage.settle_bet(user_id, 1, 1)
+        t = time.perf_counter()
+        count = await history.take_snapshots()
+        print(f"следующие снимки после {args.writes} ставок: {count} за {(time.perf_counter() - t) * 1e3:.1f} мс")
+        await add_past_snapshots()
+
+        # Баланс на момент времени: от снимка против суммы по всей истории
+        moments = [started + random.random() * args.rows * 0.001 for _ in users]
+        samples = []
+        for user_id, moment in zip(users, moments):
+            t = time.perf_counter()
+            await history.balance_at(user_id, moment)
+            samples.append(time.perf_counter() - t)
+        print(f"balance_at со снимками:            {percentiles(samples)}")
+
+        async def heavy_balance_at():
+            await history.balance_at(1, started + args.rows * 0.0005)
+
+        async def heavy_full_sum():
+            async with storage.connection() as db:
+                await db.execute_fetchall("SELECT SUM(amount) FROM transactions WHERE user_id = 1", ())
+        print(f"пользователь 1 ({args.rows // 100} записей): balance_at {await atimeit(heavy_balance_at, 20) * 1e3:.3f} мс, "
+              f"сумма всей истории {await atimeit(heavy_full_sum, 3) * 1e3:.1f} мс")
+        ok = 0
+        for user_id in users[:1000]:
+            expected, actual = await history.audit(user_id)
+            ok += expected == actual
+        print(f"сверка со снимками: {ok} из {min(len(users), 1000)} сходятся")
+        await storage.close_pool()
+
+
+# Старый перевод для сравнения: поиск получателя на одном соединении,
+# затем два UPDATE без проверки средств
+async def transfer_old(from_user_id, recipient, amount):
+    async with storage.connection() as db:
+        rows = await db.execute_fetchall("SELECT user_id FROM users WHERE username = ?", (recipient,))
+    if not rows:
+        raise storage.TransferError("Пользователь не найден")
+    await asyncio.sleep(0)
+    async with storage.connection() as db:
+        await db.execute_fetchall(storage.SQL_APPLY_DELTA, (-amount, from_user_id))
+        await db.execute_fetchall(storage.SQL_APPLY_DELTA, (amount, rows[0][0]))
+        await db.commit()
+
+
+# Встречные переводы: каждая пара пользователей переводит друг другу
+# одновременно (A->B и B->A), часть операций - пачки выплат
+def crossing_transfers(users, count, balance, batch):
+    operations = []
+    while len(operations) < count:
+        a, b = random.sample(range(1, users + 1), 2)
+        operations.append(("one", a, f"user{b}", random.randint(1, balance)))
+        operations.append(("one", b, f"user{a}", random.randint(1, balance)))
+        if batch > 1 and random.random() < 0.1:
+            recipients = random.sample([user_id for user_id in range(1, users + 1) if user_id != a], batch)
+            operations.append(("many", a, [(f"user{user_id}", random.randint(1, balance // batch)) for user_id in recipients]))
+    random.shuffle(operations)
+    return operations
+
+
+async def run_transfers(path, pool_size, clients, operations, old):
+    use_db(path, pool_size)
+    counts = collections.Counter()
+    latencies = []
+
+    async def client(operations):
+        for operation in operations:
+            started = time.perf_counter()
+            try:
+                if operation[0] == "many":
+                    await storage.transfer_many(operation[1], operation[2])
+                elif old:
+                    await transfer_old(*operation[1:])
+                else:
+                    await storage.transfer(*operation[1:])
+                counts["done"] += 1
+            except storage.TransferError:
+                counts["rejected"] += 1
+            except sqlite3.Error as e:
+                counts[f"ошибка: {e}"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client(operations[number::clients]) for number in range(clients)))
+    await storage.close_pool()
+    return counts, latencies
+
+
+def transfers_worker(path, pool_size, clients, operations, old, results):
+    results.put(asyncio.run(run_transfers(path, pool_size, clients, operations, old)))
+
+
+async def stress_transfers(name, path, args, old=False):
+    async with aiosqlite.connect(path) as db:
+        await db.execute("UPDATE users SET balance = ?", (args.balance,))
+        await db.execute("DELETE FROM transactions")
+        await db.commit()
+    operations = crossing_transfers(args.users, args.transfers, args.balance, args.batch)
+    if old:
+        operations = [operation for operation in operations if operation[0] == "one"]
+
+    # Процессы со своими пулами делят одну базу, как бот и веб-приложение
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    parts = [operations[number::args.processes] for number in range(args.processes)]
+    started = time.perf_counter()
+    workers = [context.Process(target=transfers_worker, args=(path, args.pool_size, args.clients, part, old, results)) for part in parts]
+    for worker in workers:
+        worker.start()
+    counts = collections.Counter()
+    latencies = []
+    for _ in workers:
+        part_counts, part_latencies = results.get()
+        counts.update(part_counts)
+        latencies.extend(part_latencies)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    async with aiosqlite.connect(path) as db:
+        balances = dict(await db.execute_fetchall("SELECT user_id, balance FROM users"))
+        ledger = dict(await db.execute_fetchall(
+            "SELECT user_id, SUM(amount) FROM transactions WHERE kind = ? GROUP BY user_id", (storage.TX_TRANSFER,)
+        ))
+    total = sum(balances.values())
+    negative = sum(1 for value in balances.values() if value < 0)
+    mismatched = sum(1 for user_id, value in balances.items() if value != args.balance + ledger.get(user_id, 0))
+    errors = {key: value for key, value in counts.items() if key.startswith("ошибка")}
+    print(f"{name:24} {len(operations) / elapsed:8.0f} переводов/с  {percentiles(latencies)}  "
+          f"выполнено {counts['done']}, отклонено {counts['rejected']}, ошибок {sum(errors.values())}")
+    # Старый путь журнал не пишет
+    print(f"{'':24} сумма балансов {total} из {args.balance * args.users}, отрицательных {negative}"
+          + ("" if old else f", расходится с журналом {mismatched}"))
+    for error, count in errors.items():
+        print(f"{'':24} {error}: {count}")
+    return not errors and negative == 0 and mismatched == 0 and total == args.balance * args.users
+
+
+async def bench_transfers(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        await make_db(path, args.users)
+        async with aiosqlite.connect(path) as db:
+            await db.execute("UPDATE users SET username = 'user' || user_id")
+            await db.commit()
+
+        print(f"пользователей {args.users}, процессов {args.processes}, пул {args.pool_size} на процесс")
+        ok = await stress_transfers("transfer/transfer_many", path, args)
+        # Старый путь: встречные переводы уводят балансы в минус
+        await stress_transfers("поиск + два UPDATE", path, args, old=True)
+
+    if not ok:
+        raise SystemExit("Переводы потеряли деньги, ушли в минус или завершились ошибкой")
+
+
+async def bench_metrics(args):
+    # Цена таймера: обертка вокруг пустой корутины
+    async def noop():
+        pass
+
+    timed_noop = instrumentation.timed("bench.noop")(noop)
+    overhead = await atimeit(timed_noop, args.calls) - await atimeit(noop, args.calls)
+    print(f"таймер:                   {overhead * 1e9:6.0f} нс на вызов")
+
+    # Отброшенная debug-запись против print, который был в app.py
+    logging.getLogger().setLevel(logging.INFO)
+    skipped = timeit(lambda: logging.debug("Вход %s: пароль верный", "player"), args.calls)
+    with open(os.devnull, "w") as devnull:
+        printed = timeit(lambda: print(f"Пароль для пользователя {'player'} верный", file=devnull), args.calls)
+    print(f"logging.debug ниже уровня: {skipped * 1e9:6.0f} нс, print: {printed * 1e9:.0f} нс")
+
+    # Нагрузка на обработчики бота и чтение /metrics по HTTP
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, "bench.db"))
+        instrumentation.reset()
+        await main.dp.emit_startup()
+        runner = await instrumentation.start_server(port=0)
+        update_ids = iter(range(1, 1 << 62))
+        feed = main.dp.feed_raw_update
+
+        async def player(user_id):
+            await feed(main.bot, fake_message(next(update_ids), user_id, "/start"))
+            for _ in range(args.spins):
+                await feed(main.bot, fake_callback(next(update_ids), user_id, "spin_slots"))
+                await feed(main.bot, fake_message(next(update_ids), user_id, "10"))
+            await feed(main.bot, fake_callback(next(update_ids), user_id, "balance"))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(player(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - started
+
+        port = runner.addresses[0][1]
+        async with ClientSession() as http:
+            async with http.get(f"http://127.0.0.1:{port}/metrics") as response:
+                text = await response.text()
+        await runner.cleanup()
+        await main.dp.emit_shutdown()
+
+    stages = instrumentation.summary()
+    observed = sum(stage["count"] for stage in stages.values())
+    spins = args.users * args.spins
+    print(f"{spins} спинов за {elapsed:.2f} с; замеров на спин {observed / spins:.1f}, "
+          f"доля таймеров во времени {observed * overhead / elapsed:.3%}")
+    for stage, values in stages.items():
+        if not values["count"]:
+            continue
+        print(f"  {stage:22} {values['count']:7d}  p50 {values['p50'] * 1e3:7.3f} мс  p99 {values['p99'] * 1e3:7.3f} мс")
+    counters = {line.split()[0]: line.split()[1] for line in text.splitlines() if line.endswith(tuple("0123456789"))
+                and line.startswith(("casino_spins", "casino_wins"))}
+    print(f"/metrics: {len(text.splitlines())} строк, {counters}")
+
+
+# Шаги игрока для замера обработчиков: (обработчик, обновление, данные).
+# spin_again - повтор прошлой ставки одной кнопкой под результатом
+UI_STEPS = (
+    ("cmd_start", fake_message, "/start"),
+    ("play_slots", fake_callback, "slots"),
+    ("ask_bet", fake_callback, "spin_slots"),
+    ("process_bet", fake_message, "{bet}"),
+    ("spin_again", fake_callback, "spin_again"),
+    ("show_balance", fake_callback, "balance"),
+)
+
+
+# Ответ с результатом спина, как его собирал process_bet до готовых
+# клавиатур и шаблонов: новое дерево кнопок и склейка строк на каждый спин
+def result_message_old(chat_id, spin, bet, balance):
+    text = f"🎰 Результат: {' '.join(spin.symbols)}"
+    if spin.payout > 0:
+        text += f"\n🎉 Поздравляем! Вы выиграли {spin.payout} монет!"
+    else:
+        text += f"\n😢 К сожалению, вы проиграли {bet} монет."
+    text += f"\n💰 Баланс: {balance} монет"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🎰 Крутить снова", callback_data="spin_slots")],
+        [InlineKeyboardButton(text="💰 Баланс", callback_data="balance")]
+    ])
+    return SendMessage(chat_id=chat_id, text=text, reply_markup=keyboard)
+
+
+def result_message_new(chat_id, spin, bet, balance):
+    lang = ui.locale(None)
+    return EditMessageText(chat_id=chat_id, message_id=1, text=lang.result(spin, bet, balance),
+                           reply_markup=lang.result_keyboard)
+
+
+# Сборка ответа с результатом и тела запроса без диспетчера и базы
+async def render_cost(name, make, repeat):
+    session = FakeSession(serialize=True)
+    session.middleware(ui.PreparedMarkupMiddleware())
+    bot = Bot("123456:bench", session=session)
+    spin = SlotSpin(["🍒", "🍋", "🍒"], PAIR, 10)
+
+    async def once():
+        await bot(make(1, spin, 10, 1000))
+
+    await once()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    await once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = await atimeit(once, repeat)
+    print(f"  {name:8} {elapsed * 1e6:7.1f} мкс, пик памяти {(peak - base) / 1024:5.1f} КиБ")
+
+
+# Цена обработчиков бота на одно обновление: вызовы Bot API, пиковая память
+# (все временные объекты обработчика, клавиатуры и тела запроса) и время.
+# Сессия собирает тело каждого запроса, как перед отправкой в Telegram.
+# Время и память замеряются в разных проходах: tracemalloc замедляет код.
+async def bench_ui(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        main = load_bot(os.path.join(tmp, "bench.db"), session=FakeSession(serialize=True))
+        await main.dp.emit_startup()
+        bot = main.bot
+        update_ids = iter(range(1, 1 << 62))
+        calls = collections.Counter()
+        handled = collections.Counter()
+        elapsed = collections.defaultdict(list)
+        peaks = collections.defaultdict(list)
+
+        async def play(user_id, traced):
+            for name, make, data in UI_STEPS:
+                update = Update.model_validate(make(next(update_ids), user_id, data.format(bet=args.bet)),
+                                               context={"bot": bot})
+                before = sum(bot.session.calls.values())
+                if traced:
+                    tracemalloc.reset_peak()
+                    base, _ = tracemalloc.get_traced_memory()
+                started = time.perf_counter()
+                result = await main.dp.feed_update(bot, update)
+                if traced:
+                    _, peak = tracemalloc.get_traced_memory()
+                    peaks[name].append(peak - base)
+                    continue
+                elapsed[name].append(time.perf_counter() - started)
+                calls[name] += sum(bot.session.calls.values()) - before
+                handled[name] += result is not UNHANDLED
+
+        for user_id in range(1, args.users + 1):
+            await play(user_id, False)
+        tracemalloc.start()
+        for user_id in range(args.users + 1, 2 * args.users + 1):
+            await play(user_id, True)
+        tracemalloc.stop()
+        await main.dp.emit_shutdown()
+
+    print(f"игроков {args.users}, ставка {args.bet}; на одно обновление:")
+    for name, _, _ in UI_STEPS:
+        if not handled[name]:
+            print(f"  {name:13} нет обработчика")
+            continue
+        print(f"  {name:13} вызовов API {calls[name] / args.users:.2f}, "
+              f"пик памяти {statistics.median(peaks[name]) / 1024:6.1f} КиБ, "
+              f"{statistics.median(elapsed[name]) * 1e6:7.1f} мкс")
+
+    print("ответ с результатом спина: текст, клавиатура и тело запроса")
+    await render_cost("было", result_message_old, args.repeat)
+    await render_cost("стало", result_message_new, args.repeat)
+
+
+# Сценарий игрока: /start, меню слотов, rounds раз "Крутить" и ставка, баланс
+def player_script(user_id, rounds, bet, update_ids):
+    script = [("start", fake_message(next(update_ids), user_id, "/start")),
+              ("slots", fake_callback(next(update_ids), user_id, "slots"))]
+    for _ in range(rounds):
+        script.append(("spin", fake_callback(next(update_ids), user_id, "spin_slots")))
+        script.append(("bet", fake_message(next(update_ids), user_id, str(bet))))
+    script.append(("balance", fake_callback(next(update_ids), user_id, "balance")))
+    return script
+
+
+# Замер ожидания блокировки записи со стороны другого соединения
+# (как у веб-приложения или второго процесса бота): BEGIN IMMEDIATE и откат
+def probe_write_lock(path, stop, samples, interval=0.01):
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("ROLLBACK")
+            samples.append(time.perf_counter() - started)
+            stop.wait(interval)
+    finally:
+        db.close()
+
+
+# Синтетический трафик Telegram через dp.feed_update: users игроков проходят
+# свои сценарии, одновременно играют не больше concurrency игроков, обновления
+# одного игрока идут по порядку, как в одном чате. Обновления собираются
+# заранее, поэтому замер включает только диспетчер, обработчики и базу.
+async def bench_load(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        if args.db:
+            copy_db(args.db, path)
+        main = load_bot(path, api_ms=args.api_ms, limits=args.limits)
+        instrumentation.reset()
+        await main.dp.emit_startup()
+        bot = main.bot
+
+        update_ids = iter(range(1, 1 << 62))
+        players = collections.deque(
+            [(kind, Update.model_validate(data, context={"bot": bot}))
+             for kind, data in player_script(user_id, args.rounds, args.bet, update_ids)]
+            for user_id in range(args.first_user, args.first_user + args.users)
+        )
+        total = sum(len(script) for script in players)
+        latencies = collections.defaultdict(list)
+        errors = collections.Counter()
+
+        async def worker():
+            while players:
+                for kind, update in players.popleft():
+                    started = time.perf_counter()
+                    try:
+                        await main.dp.feed_update(bot, update)
+                    except Exception as e:
+                        errors[f"{type(e).__name__}: {e}"] += 1
+                    latencies[kind].append(time.perf_counter() - started)
+
+        stop = threading.Event()
+        lock_waits = []
+        probe = threading.Thread(target=probe_write_lock, args=(path, stop, lock_waits), daemon=True)
+        probe.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        probe.join()
+
+        pool = storage.pool_metrics()
+        ledger = main.ledger.metrics()
+        calls = sum(bot.session.calls.values())
+        await main.dp.emit_shutdown()
+
+    print(f"игроков {args.users}, одновременно {args.concurrency}, обновлений {total}, "
+          f"задержка API {args.api_ms} мс, защита от флуда {'вкл' if args.limits else 'выкл'}")
+    print(f"пропускная способность: {total / elapsed:8.0f} обновлений/с за {elapsed:.2f} с, "
+          f"вызовов API на обновление {calls / total:.2f}")
+    everything = [value for values in latencies.values() for value in values]
+    print(f"  {'все':8} {percentiles(everything)}, max {max(everything) * 1e3:.1f} мс")
+    for kind, values in latencies.items():
+        print(f"  {kind:8} {percentiles(values)}")
+    print(f"пул: ожиданий {pool['waits']} из {pool['checkouts']} выдач, ожидание max {pool['wait_time_max'] * 1e3:.1f} мс, "
+          f"выдача avg {pool['checkout_latency_avg'] * 1e3:.3f} мс, удержание avg {pool['hold_time_avg'] * 1e3:.3f} мс")
+    print(f"журнал спинов: пачек {ledger['batches']}, в среднем {ledger['avg_batch']:.1f} ставок")
+    if len(lock_waits) > 1:
+        print(f"блокировка записи для другого соединения: {percentiles(lock_waits)}, "
+              f"max {max(lock_waits) * 1e3:.1f} мс ({len(lock_waits)} замеров)")
+    for stage, values in instrumentation.summary().items():
+        if values["count"] and stage.startswith(("db.", "ledger.")):
+            print(f"  {stage:20} {values['count']:7d}  p50 {values['p50'] * 1e3:7.3f} мс  p99 {values['p99'] * 1e3:7.3f} мс")
+    for error, count in errors.most_common(5):
+        print(f"ошибка ({count}): {error}")
+
+
+# Запуск app.py в отдельном процессе через AppTest: первый прогон скрипта
+# (импорты и разовая инициализация) и повторные прогоны страницы игрока,
+# как при каждом действии в браузере. Маркер в stderr отделяет импорты
+# самого AppTest от импортов приложения в выводе -X importtime.
+STARTUP_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+print("startup-marker", file=sys.stderr, flush=True)
+started = time.perf_counter()
+at.run()
+first = time.perf_counter() - started
+at.text_input[2].input("player"); at.text_input[3].input("secret1"); at.text_input[4].input("secret1")
+at.button[1].click().run()
+at.text_input[0].input("player"); at.text_input[1].input("secret1")
+at.button[0].click().run()
+reruns = []
+for _ in range(int(sys.argv[2])):
+    started = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - started)
+print(json.dumps({"first": first, "reruns": reruns, "logged_in": at.session_state.is_logged_in}))
+"""
+
+
+def startup_run(path, reruns, importtime=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, CASINO_DB=os.path.join(tmp, "bench.db"), LOG_LEVEL="WARNING",
+                   PYTHONPATH=os.path.dirname(path))
+        command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", STARTUP_SCRIPT, path, str(reruns)]
+        done = subprocess.run(command, env=env, capture_output=True, text=True, cwd=tmp)
+    if done.returncode:
+        raise RuntimeError(f"app.py завершился с ошибкой:\n{done.stderr[-2000:]}")
+    return json.loads(done.stdout.splitlines()[-1]), done.stderr
+
+
+# Самые дорогие импорты верхнего уровня при первом прогоне app.py
+def startup_imports(stderr, top):
+    modules = []
+    after_marker = False
+    for line in stderr.splitlines():
+        if line == "startup-marker":
+            after_marker = True
+        elif after_marker and line.startswith("import time:") and "self [us]" not in line:
+            _, cumulative, name = line.split("|")
+            # Уровень вложенности - отступ имени по два пробела
+            if len(name) - len(name.lstrip()) <= 2:
+                modules.append((int(cumulative), name.strip()))
+    total = sum(cumulative for cumulative, _ in modules)
+    print(f"импорты app.py: {total / 1e3:.0f} мс")
+    for cumulative, name in sorted(modules, reverse=True)[:top]:
+        print(f"  {cumulative / 1e3:7.1f} мс  {name}")
+
+
+def bench_startup(args):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    _, stderr = startup_run(path, 0, importtime=True)
+    startup_imports(stderr, args.top)
+    firsts, reruns = [], []
+    for _ in range(args.processes):
+        result, _ = startup_run(path, args.reruns)
+        if not result["logged_in"]:
+            raise RuntimeError("Не удалось войти в приложение")
+        firsts.append(result["first"])
+        reruns.extend(result["reruns"])
+    print(f"холодный старт (первый прогон скрипта): медиана {statistics.median(firsts) * 1e3:.0f} мс "
+          f"из {args.processes} процессов")
+    print(f"повторный прогон страницы игрока: {percentiles(reruns)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки казино")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ledger = commands.add_parser("ledger", help="спины/с: прямая запись против журнала с групповым коммитом")
+    ledger.add_argument("--players", type=int, default=200)
+    ledger.add_argument("--spins", type=int, default=20)
+    ledger.add_argument("--pool-size", type=int, default=storage.POOL_SIZE)
+    ledger.add_argument("--flush-ms", type=int, default=10)
+    ledger.add_argument("--batch", type=int, default=256)
+    ledger.add_argument("--queue", type=int, default=4096)
+    ledger.set_defaults(handler=bench_ledger)
+
+    settle = commands.add_parser("settle", help="стресс-тест атомарного расчета ставок")
+    settle.add_argument("--users", type=int, default=10)
+    settle.add_argument("--spins", type=int, default=5000)
+    settle.add_argument("--balance", type=int, default=100)
+    settle.add_argument("--pool-size", type=int, default=storage.POOL_SIZE)
+    settle.set_defaults(handler=bench_settle)
+
+    top = commands.add_parser("leaderboard", help="топ игроков: ORDER BY против таблицы лидеров в памяти")
+    top.add_argument("--users", type=int, default=1_000_000)
+    top.set_defaults(handler=bench_leaderboard)
+
+    games = commands.add_parser("engine", help="пропускная способность движка исходов")
+    games.add_argument("--spins", type=int, default=50_000_000)
+    games.add_argument("--chunk", type=int, default=1_000_000)
+    games.add_argument("--seed", type=int, default=None)
+    games.set_defaults(handler=bench_engine)
+
+    rtp = commands.add_parser("rtp", help="Монте-Карло: RTP, частота выигрыша, дисперсия, кривые разорения")
+    rtp.add_argument("--spins", type=int, default=100_000_000)
+    rtp.add_argument("--chunk", type=int, default=2_000_000)
+    rtp.add_argument("--workers", type=int, default=None)
+    rtp.add_argument("--seed", type=int, default=None)
+    rtp.add_argument("--numbers", type=int, nargs=3, default=(7, 17, 27), help="числа ставки в рулетке")
+    rtp.add_argument("--paths", type=int, default=20_000, help="игроков в симуляции разорения")
+    rtp.add_argument("--horizon", type=int, default=1000, help="спинов на игрока")
+    rtp.add_argument("--bankroll", type=int, default=20, help="начальный банкролл в ставках")
+    rtp.add_argument("--output", default="rtp.json")
+    rtp.add_argument("--baseline", help="JSON предыдущего прогона для проверки скорости")
+    rtp.add_argument("--tolerance", type=float, default=0.2, help="допустимое падение скорости")
+    rtp.add_argument("--gate-z", type=float, default=5.0, help="допустимое отклонение RTP в стандартных ошибках")
+    rtp.set_defaults(handler=bench_rtp)
+
+    loop = commands.add_parser("bridge", help="запросы app.py: asyncio.run на каждый вызов против постоянного цикла")
+    loop.add_argument("--users", type=int, default=10_000)
+    loop.add_argument("--reruns", type=int, default=2000)
+    loop.set_defaults(handler=bench_bridge)
+
+    store = commands.add_parser("sessions", help="нагрузочный тест хранилища сессий")
+    store.add_argument("--sessions", type=int, default=10_000)
+    store.add_argument("--lookups", type=int, default=50_000)
+    store.set_defaults(handler=bench_sessions)
+
+    passwords = commands.add_parser("passwords", help="входов/с на ядро при разной стоимости KDF")
+    passwords.add_argument("--logins", type=int, default=20)
+    passwords.add_argument("--workers", type=int, default=None)
+    passwords.add_argument("--scrypt-log-n", type=int, nargs="*", default=[12, 14, 15, 16])
+    passwords.add_argument("--pbkdf2-iterations", type=int, nargs="*", default=[100_000, 300_000, 600_000])
+    passwords.set_defaults(handler=bench_passwords)
+
+    register = commands.add_parser("register", help="регистрация: по одному против register_many")
+    register.add_argument("--users", type=int, default=100_000)
+    register.set_defaults(handler=bench_register)
+
+    migrate = commands.add_parser("migrate", help="миграция схемы и время старта на большой базе")
+    migrate.add_argument("--users", type=int, default=2_000_000)
+    migrate.add_argument("--starts", type=int, default=200)
+    migrate.set_defaults(handler=bench_migrate)
+
+    hook = commands.add_parser("webhook", help="обновлений/с через вебхук aiohttp и process_bet")
+    hook.add_argument("--users", type=int, default=500)
+    hook.add_argument("--spins", type=int, default=10)
+    hook.add_argument("--bet", type=int, default=10)
+    hook.add_argument("--concurrency", type=int, default=webhook.WEBHOOK_CONCURRENCY)
+    hook.add_argument("--max-pending", type=int, default=webhook.WEBHOOK_MAX_PENDING)
+    hook.add_argument("--api-ms", type=float, default=0.0, help="имитация задержки Bot API")
+    hook.set_defaults(handler=bench_webhook)
+
+    states = commands.add_parser("fsm", help="память и задержка хранилищ состояний бота")
+    states.add_argument("--users", type=int, default=1_000_000)
+    states.add_argument("--sqlite-users", type=int, default=100_000)
+    states.add_argument("--ttl", type=float, default=5.0)
+    states.set_defaults(handler=bench_fsm)
+
+    flood = commands.add_parser("throttle", help="нагрузочный тест защиты от флуда")
+    flood.add_argument("--spammers", type=int, default=10)
+    flood.add_argument("--spam-rate", type=float, default=20.0, help="нажатий в секунду на флудера")
+    flood.add_argument("--players", type=int, default=30)
+    flood.add_argument("--duration", type=float, default=5.0)
+    flood.add_argument("--retry-after", type=int, default=1)
+    flood.set_defaults(handler=bench_throttle)
+
+    auto = commands.add_parser("autoplay", help="стоимость спина: process_bet против автоигры")
+    auto.add_argument("--users", type=int, default=200)
+    auto.add_argument("--spins", type=int, default=50)
+    auto.add_argument("--bet", type=int, default=10)
+    auto.set_defaults(handler=bench_autoplay)
+
+    ledger_history = commands.add_parser("history", help="журнал операций: история, снимки, запись на большой базе")
+    ledger_history.add_argument("--rows", type=int, default=100_000_000)
+    ledger_history.add_argument("--users", type=int, default=1_000_000)
+    ledger_history.add_argument("--samples", type=int, default=2000)
+    ledger_history.add_argument("--writes", type=int, default=2000)
+    ledger_history.add_argument("--depth", type=int, default=500_000, help="глубина страницы у длинной истории")
+    ledger_history.add_argument("--dir", default=None, help="каталог для временной базы")
+    ledger_history.set_defaults(handler=bench_history)
+
+    transfers = commands.add_parser("transfers", help="стресс-тест встречных переводов и пачек выплат")
+    transfers.add_argument("--users", type=int, default=20)
+    transfers.add_argument("--transfers", type=int, default=5000)
+    transfers.add_argument("--balance", type=int, default=100)
+    transfers.add_argument("--batch", type=int, default=5, help="получателей в пачке выплат")
+    transfers.add_argument("--processes", type=int, default=2)
+    transfers.add_argument("--clients", type=int, default=32, help="одновременных клиентов на процесс")
+    transfers.add_argument("--pool-size", type=int, default=storage.POOL_SIZE)
+    transfers.set_defaults(handler=bench_transfers)
+
+    timers = commands.add_parser("metrics", help="цена таймеров и логов, p50/p99 по этапам и /metrics")
+    timers.add_argument("--calls", type=int, default=200_000)
+    timers.add_argument("--users", type=int, default=200)
+    timers.add_argument("--spins", type=int, default=10)
+    timers.set_defaults(handler=bench_metrics)
+
+    load = commands.add_parser("load", help="синтетический трафик Telegram через диспетчер бота")
+    load.add_argument("--users", type=int, default=5000)
+    load.add_argument("--concurrency", type=int, default=500, help="игроков одновременно")
+    load.add_argument("--rounds", type=int, default=3, help="ставок на игрока")
+    load.add_argument("--bet", type=int, default=10)
+    load.add_argument("--api-ms", type=float, default=0.0, help="задержка ответа Bot API")
+    load.add_argument("--limits", action="store_true", help="с защитой от флуда и очередью отправки")
+    load.add_argument("--first-user", type=int, default=1, help="Telegram id первого игрока")
+    load.add_argument("--db", default=None, help="рабочая база, например casino.db: тест идет на ее копии (по умолчанию пустая временная)")
+    load.set_defaults(handler=bench_load)
+
+    screens = commands.add_parser("ui", help="вызовы API, память и время обработчиков бота")
+    screens.add_argument("--users", type=int, default=500)
+    screens.add_argument("--bet", type=int, default=10)
+    screens.add_argument("--repeat", type=int, default=20_000, help="повторов сборки ответа")
+    screens.set_defaults(handler=bench_ui)
+
+    cold = commands.add_parser("startup", help="холодный старт и повторные прогоны app.py, профиль импортов")
+    cold.add_argument("--processes", type=int, default=5)
+    cold.add_argument("--reruns", type=int, default=30)
+    cold.add_argument("--top", type=int, default=12, help="сколько импортов показать")
+    cold.set_defaults(handler=bench_startup)
+
+    args = parser.parse_args()
+    result = args.handler(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+
+# Счетчики вызовов через мост
+class BridgeStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+# Постоянный цикл событий в фоновом потоке с синхронным фасадом.
+# Streamlit выполняет скрипт синхронно, поэтому вместо asyncio.run на каждый
+# запрос к базе корутины отправляются в один долгоживущий цикл: он не
+# создается заново, а соединения пула остаются в одном цикле.
+class AsyncBridge:
+    def __init__(self, name="casino-loop"):
+        self.name = name
+        self.stats = BridgeStats()
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        self._loop = loop
+
+    # Отправить корутину в цикл, не дожидаясь результата
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # Выполнить корутину и дождаться результата в вызывающем потоке
+    def run(self, coro, timeout=None):
+        started = time.perf_counter()
+        try:
+            return self.submit(coro).result(timeout)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.stats
+            with self._lock:
+                stats.calls += 1
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+
+    # Выполнить независимые корутины одновременно; результаты в порядке аргументов
+    def gather(self, *coros, timeout=None, return_exceptions=False):
+        async def gather_all():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return self.run(gather_all(), timeout)
+
+    def metrics(self):
+        stats = self.stats
+        with self._lock:
+            return {
+                "calls": stats.calls,
+                "avg_time": stats.total_time / stats.calls if stats.calls else 0.0,
+                "max_time": stats.max_time,
+            }
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._thread = self._thread, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+# Общий мост процесса
+bridge = AsyncBridge()
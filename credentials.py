@@ -0,0 +1,128 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+# Параметры хеширования паролей; стоимость подбирается под нагрузку
+# (см. python bench.py passwords)
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "scrypt")
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "600000"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+VERSION = 1
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    maxmem = max(256 * n * r * p, 32 * 1024 * 1024)
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=KEY_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=KEY_BYTES)
+
+
+def _parse_params(text):
+    return {key: int(value) for key, value in (item.split("=") for item in text.split(","))}
+
+
+# Хеширование паролей с солью и версионированным форматом:
+#   $scrypt$v=1$n=16384,r=8,p=1$<соль>$<хеш>
+#   $pbkdf2-sha256$v=1$i=600000$<соль>$<хеш>
+# Старые хеши (несоленый SHA-256 в hex) проверяются и помечаются на перехеширование.
+class PasswordHasher:
+    def __init__(self, scheme=PASSWORD_SCHEME, scrypt_n=SCRYPT_N, scrypt_r=SCRYPT_R,
+                 scrypt_p=SCRYPT_P, pbkdf2_iterations=PBKDF2_ITERATIONS):
+        if scheme not in ("scrypt", "pbkdf2-sha256"):
+            raise ValueError(f"Неизвестная схема хеширования: {scheme}")
+        self.scheme = scheme
+        self.scrypt_params = {"n": scrypt_n, "r": scrypt_r, "p": scrypt_p}
+        self.pbkdf2_iterations = pbkdf2_iterations
+
+    def hash(self, password):
+        salt = secrets.token_bytes(SALT_BYTES)
+        if self.scheme == "scrypt":
+            params = self.scrypt_params
+            key = _scrypt(password, salt, **params)
+            encoded = f"n={params['n']},r={params['r']},p={params['p']}"
+        else:
+            key = _pbkdf2(password, salt, self.pbkdf2_iterations)
+            encoded = f"i={self.pbkdf2_iterations}"
+        return f"${self.scheme}$v={VERSION}${encoded}${_b64encode(salt)}${_b64encode(key)}"
+
+    def verify(self, password, stored):
+        if not stored:
+            return False
+        if not stored.startswith("$"):
+            # Старый формат: SHA-256 без соли
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, stored)
+        try:
+            _, scheme, _, encoded, salt, key = stored.split("$")
+            params = _parse_params(encoded)
+            salt, key = _b64decode(salt), _b64decode(key)
+        except ValueError:
+            return False
+        # Нет нужного параметра или значение недопустимо для KDF -
+        # хеш поврежден, как и при неизвестной схеме вход не проходит
+        try:
+            if scheme == "scrypt":
+                candidate = _scrypt(password, salt, params["n"], params["r"], params["p"])
+            elif scheme == "pbkdf2-sha256":
+                candidate = _pbkdf2(password, salt, params["i"])
+            else:
+                return False
+        except (KeyError, ValueError, OverflowError):
+            return False
+        return hmac.compare_digest(candidate, key)
+
+    # Нужно ли пересчитать хеш: старый формат, другая схема или стоимость
+    def needs_rehash(self, stored):
+        if not stored or not stored.startswith("$"):
+            return True
+        try:
+            _, scheme, version, encoded, _, _ = stored.split("$")
+            params = _parse_params(encoded)
+        except ValueError:
+            return True
+        if scheme != self.scheme or version != f"v={VERSION}":
+            return True
+        if scheme == "scrypt":
+            return params != self.scrypt_params
+        return params != {"i": self.pbkdf2_iterations}
+
+
+hasher = PasswordHasher()
+
+# KDF работает вне цикла событий и потока Streamlit: hashlib отпускает GIL,
+# поэтому пул потоков загружает все ядра
+_executor = ThreadPoolExecutor(HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def hash_password(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hasher.hash, password)
+
+
+async def verify_password(password, stored):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hasher.verify, password, stored)
+
+
+def needs_rehash(stored):
+    return hasher.needs_rehash(stored)
@@ -0,0 +1,83 @@
+import collections
+import threading
+
+import numpy as np
+
+# Символы для слотов
+SLOT_SYMBOLS = ("🍒", "🍊", "🍋", "🍇", "7️⃣", "💰")
+REELS = 3
+
+# Выплаты слотов: три одинаковых - x3, любая пара - x1, иначе ставка проиграна
+LOSE, PAIR, TRIPLE = 0, 1, 2
+TRIPLE_MULTIPLIER = 3
+PAIR_MULTIPLIER = 1
+
+# Рулетка: числа 1-36, выигрыш - ставка x36
+ROULETTE_NUMBERS = 36
+ROULETTE_MULTIPLIER = 36
+
+SlotSpin = collections.namedtuple("SlotSpin", "symbols kind payout")
+SlotBatch = collections.namedtuple("SlotBatch", "reels kinds payouts")
+RouletteBatch = collections.namedtuple("RouletteBatch", "numbers payouts")
+
+
+# Подсчет исхода для уже выпавших барабанов (массив n x 3 индексов символов)
+def score_reels(reels, bet):
+    a, b, c = reels[:, 0], reels[:, 1], reels[:, 2]
+    triple = (a == b) & (b == c)
+    pair = (a == b) | (b == c) | (a == c)
+    kinds = np.where(triple, TRIPLE, np.where(pair, PAIR, LOSE)).astype(np.int8)
+    bet = np.asarray(bet, dtype=np.int64)
+    payouts = np.where(triple, bet * TRIPLE_MULTIPLIER, np.where(pair, bet * PAIR_MULTIPLIER, -bet))
+    return kinds, payouts
+
+
+# Движок исходов игр на потоке ГПСЧ NumPy.
+# Исходы считаются пачками без цикла Python на каждый спин; seed делает
+# поток воспроизводимым для симуляций. Generator не потокобезопасен,
+# поэтому выборка защищена блокировкой (Streamlit вызывает движок из разных потоков).
+class GameEngine:
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    # Новый поток ГПСЧ: процессы, созданные через fork, иначе продолжают
+    # одно и то же состояние генератора и выдают одинаковые исходы
+    def reseed(self, seed=None):
+        with self._lock:
+            self.rng = np.random.default_rng(seed)
+
+    def slot_reels(self, n):
+        with self._lock:
+            return self.rng.integers(0, len(SLOT_SYMBOLS), size=(n, REELS), dtype=np.uint8)
+
+    # n спинов слотов со ставкой bet (число или массив длины n)
+    def spin_many(self, n, bet):
+        reels = self.slot_reels(n)
+        kinds, payouts = score_reels(reels, bet)
+        return SlotBatch(reels, kinds, payouts)
+
+    def spin(self, bet):
+        batch = self.spin_many(1, bet)
+        symbols = [SLOT_SYMBOLS[i] for i in batch.reels[0]]
+        return SlotSpin(symbols, int(batch.kinds[0]), int(batch.payouts[0]))
+
+    def roulette_numbers(self, n):
+        with self._lock:
+            return self.rng.integers(1, ROULETTE_NUMBERS + 1, size=n, dtype=np.uint8)
+
+    # n вращений рулетки со ставкой bet на выбранные числа
+    def roulette_many(self, n, bet, numbers):
+        drawn = self.roulette_numbers(n)
+        hit = np.isin(drawn, np.asarray(numbers, dtype=np.uint8))
+        bet = np.asarray(bet, dtype=np.int64)
+        payouts = np.where(hit, bet * ROULETTE_MULTIPLIER, -bet)
+        return RouletteBatch(drawn, payouts)
+
+    def roulette(self, bet, numbers):
+        batch = self.roulette_many(1, bet, numbers)
+        return int(batch.numbers[0]), int(batch.payouts[0])
+
+
+# Общий движок процесса
+engine = GameEngine()
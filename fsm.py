@@ -0,0 +1,206 @@
+import abc
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import time
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, DEFAULT_DESTINY
+
+import storage
+
+# Хранилище состояний бота: memory - в памяти процесса, sqlite - в общей базе
+# (нужно, когда процессов бота несколько, и чтобы пережить перезапуск)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+# Состояние, к которому не возвращались FSM_TTL секунд, забывается
+FSM_TTL = float(os.getenv("FSM_TTL", "900"))
+FSM_MAX_KEYS = int(os.getenv("FSM_MAX_KEYS", "1000000"))
+FSM_EXPIRY_INTERVAL = float(os.getenv("FSM_EXPIRY_INTERVAL", "60"))
+
+# Состояния бота
+class BetStates(StatesGroup):
+    waiting_for_bet = State()
+
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+# Общая часть хранилищ с истечением: фоновая очистка устаревших записей
+class ExpiringStorage(BaseStorage):
+    # Удалить устаревшие записи; возвращает их число
+    @abc.abstractmethod
+    async def purge_expired(self):
+        pass
+
+    async def run_expiry(self, interval=FSM_EXPIRY_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logging.exception("Ошибка при удалении устаревших состояний")
+
+    async def close(self):
+        pass
+
+
+# Запись состояния: без __dict__, пустые данные хранятся как None
+class StateRecord:
+    __slots__ = ("state", "data", "expires")
+
+    def __init__(self, state, data, expires):
+        self.state = state
+        self.data = data
+        self.expires = expires
+
+
+# Хранилище в памяти с ограничением размера и временем жизни записей.
+# Запись удаляется, как только в ней не остается ни состояния, ни данных,
+# поэтому память занимают только пользователи посреди диалога. Записи
+# упорядочены по времени изменения: устаревшие и лишние снимаются с начала.
+# Ключ личного чата - просто user_id, остальные - кортеж полей StorageKey.
+class TTLMemoryStorage(ExpiringStorage):
+    def __init__(self, ttl=FSM_TTL, maxsize=FSM_MAX_KEYS):
+        if maxsize < 1:
+            raise ValueError("Размер хранилища должен быть положительным")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.evicted = 0
+        self._records = collections.OrderedDict()
+        self._bot_id = None
+
+    def _key(self, key):
+        if self._bot_id is None:
+            self._bot_id = key.bot_id
+        if (key.chat_id == key.user_id and key.bot_id == self._bot_id and key.thread_id is None
+                and key.business_connection_id is None and key.destiny == DEFAULT_DESTINY):
+            return key.user_id
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+
+    def _get(self, key):
+        key = self._key(key)
+        record = self._records.get(key)
+        if record is not None and record.expires <= time.monotonic():
+            del self._records[key]
+            return None
+        return record
+
+    def _put(self, key, state, data):
+        key = self._key(key)
+        if state is None and not data:
+            self._records.pop(key, None)
+            return
+        self._records[key] = StateRecord(state, data or None, time.monotonic() + self.ttl)
+        self._records.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        records = self._records
+        now = time.monotonic()
+        while records:
+            oldest = next(iter(records.values()))
+            if oldest.expires > now and len(records) <= self.maxsize:
+                break
+            records.popitem(last=False)
+            self.evicted += 1
+
+    async def set_state(self, key, state=None):
+        # Имя состояния собирается заново при каждом обращении - храним одну копию строки
+        state = _state_name(state)
+        if state is not None:
+            state = sys.intern(state)
+        record = self._get(key)
+        self._put(key, state, record.data if record else None)
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key, data):
+        record = self._get(key)
+        self._put(key, record.state if record else None, dict(data))
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return dict(record.data) if record and record.data else {}
+
+    async def purge_expired(self):
+        before = len(self._records)
+        self._evict()
+        return before - len(self._records)
+
+    def metrics(self):
+        return {"size": len(self._records), "evicted": self.evicted}
+
+    def __len__(self):
+        return len(self._records)
+
+
+# Хранилище в таблице fsm_states общей базы: состояние видят все процессы
+# бота и оно переживает перезапуск. Таблицу создает миграция create_fsm_states.
+# Состояние и данные меняются одним UPSERT без предварительного чтения.
+class SQLiteStorage(ExpiringStorage):
+    def __init__(self, ttl=FSM_TTL):
+        self.ttl = ttl
+        self._keys = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+    async def _get(self, key):
+        async with storage.connection() as db:
+            async with db.execute(
+                "SELECT state, data FROM fsm_states WHERE key = ? AND expires_at > ?",
+                (self._keys.build(key), time.time()),
+            ) as cursor:
+                return await cursor.fetchone()
+
+    # Записать один столбец (state или data), сохранив второй, если запись не истекла.
+    # Запись без состояния и данных удаляется.
+    async def _put(self, key, column, value):
+        other = "data" if column == "state" else "state"
+        key = self._keys.build(key)
+        now = time.time()
+        async with storage.connection() as db:
+            if value is None:
+                await db.execute(
+                    f"DELETE FROM fsm_states WHERE key = ? AND ({other} IS NULL OR expires_at <= ?)", (key, now)
+                )
+                await db.execute(f"UPDATE fsm_states SET {column} = NULL WHERE key = ?", (key,))
+            else:
+                await db.execute(
+                    f"INSERT INTO fsm_states (key, {column}, expires_at) VALUES (?, ?, ?) "
+                    f"ON CONFLICT (key) DO UPDATE SET {column} = excluded.{column}, "
+                    f"{other} = CASE WHEN expires_at > ? THEN {other} END, expires_at = excluded.expires_at",
+                    (key, value, now + self.ttl, now),
+                )
+            await db.commit()
+
+    async def set_state(self, key, state=None):
+        await self._put(key, "state", _state_name(state))
+
+    async def get_state(self, key):
+        row = await self._get(key)
+        return row["state"] if row else None
+
+    async def set_data(self, key, data):
+        await self._put(key, "data", json.dumps(data) if data else None)
+
+    async def get_data(self, key):
+        row = await self._get(key)
+        return json.loads(row["data"]) if row and row["data"] else {}
+
+    async def purge_expired(self):
+        async with storage.connection() as db:
+            cursor = await db.execute("DELETE FROM fsm_states WHERE expires_at <= ?", (time.time(),))
+            await db.commit()
+            return cursor.rowcount
+
+
+def create_storage(kind=FSM_STORAGE):
+    if kind == "memory":
+        return TTLMemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Неизвестное хранилище состояний: {kind}")
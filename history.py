@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import instrumentation
+import storage
+
+# Размер страницы истории и период снимков балансов
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "3600"))
+# Пользователей на одну транзакцию снимков: столько держится блокировка записи
+SNAPSHOT_CHUNK = int(os.getenv("SNAPSHOT_CHUNK", "1000"))
+
+# Страница истории по ключу (ts, id), а не по OFFSET: стоимость не зависит
+# от того, насколько глубоко листает пользователь
+SQL_HISTORY = (
+    "SELECT id, ts, kind, amount, counterparty FROM transactions "
+    "WHERE user_id = ? AND (ts, id) < (?, ?) ORDER BY ts DESC, id DESC LIMIT ?"
+)
+# Пользователи с операциями в диапазоне id после предыдущего снимка одной
+# JSON-строкой. Диапазон читается по id (NOT INDEXED не дает планировщику
+# обойти весь индекс (user_id, ts)), DISTINCT держит в памяти только
+# пользователей, а не сами операции
+SQL_CHANGED_USERS = (
+    "SELECT json_group_array(user_id) FROM "
+    "(SELECT DISTINCT user_id FROM transactions NOT INDEXED WHERE id > ? AND id <= ?)"
+)
+# Снимки для пачки пользователей: последняя операция не позже границы
+# диапазона и баланс сразу после нее (текущий баланс минус более поздние операции).
+# Здесь и ниже операции отбираются по id; условия на ts не меняют результат
+# (ts не убывает вместе с id, см. storage.SQL_RECORD_TRANSACTION) и только
+# ограничивают просмотр индекса (user_id, ts)
+SQL_TAKE_SNAPSHOTS = """
+    INSERT OR IGNORE INTO balance_snapshots (user_id, tx_id, ts, balance)
+    SELECT t.user_id, t.id, t.ts, u.balance - (
+        SELECT COALESCE(SUM(amount), 0) FROM transactions
+        WHERE user_id = t.user_id AND ts >= t.ts AND id > t.id
+    )
+    FROM json_each(?) changed
+    JOIN transactions t ON t.id = (
+        SELECT id FROM transactions WHERE user_id = changed.value AND id <= ?
+        ORDER BY ts DESC, id DESC LIMIT 1
+    )
+    JOIN users u ON u.user_id = changed.value
+"""
+SQL_SNAPSHOT_BEFORE = (
+    "SELECT tx_id, ts, balance FROM balance_snapshots "
+    "WHERE user_id = ? AND ts <= ? ORDER BY tx_id DESC LIMIT 1"
+)
+SQL_SNAPSHOT_AFTER = (
+    "SELECT tx_id, ts, balance FROM balance_snapshots "
+    "WHERE user_id = ? AND ts > ? ORDER BY tx_id LIMIT 1"
+)
+SQL_LATEST_SNAPSHOT = (
+    "SELECT tx_id, ts, balance FROM balance_snapshots WHERE user_id = ? ORDER BY tx_id DESC LIMIT 1"
+)
+SQL_SUM_AFTER = "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = ? AND ts >= ? AND ts <= ? AND id > ?"
+SQL_SUM_BETWEEN = (
+    "SELECT COALESCE(SUM(amount), 0) FROM transactions "
+    "WHERE user_id = ? AND ts > ? AND ts <= ? AND id <= ?"
+)
+
+
+# Страница истории операций пользователя, от новых к старым.
+# before - курсор из предыдущей страницы. Возвращает (операции, курсор
+# следующей страницы или None, если страница последняя).
+@instrumentation.timed("db.history")
+async def history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    ts, tx_id = before or (float("inf"), 0)
+    async with storage.connection() as db:
+        rows = await db.execute_fetchall(SQL_HISTORY, (user_id, ts, tx_id, limit))
+    entries = [dict(row) for row in rows]
+    cursor = (entries[-1]["ts"], entries[-1]["id"]) if len(entries) == limit else None
+    return entries, cursor
+
+
+async def _one(db, sql, params):
+    rows = await db.execute_fetchall(sql, params)
+    return rows[0] if rows else None
+
+
+# Снимки балансов пользователей, у которых появились операции после
+# предыдущего снимка. Список пользователей читается без блокировки записи,
+# снимки пишутся пачками по chunk_size пользователей в коротких транзакциях
+# BEGIN IMMEDIATE, чтобы не задерживать ставки. Возвращает число снимков.
+@instrumentation.timed("db.take_snapshots")
+async def take_snapshots(chunk_size=SNAPSHOT_CHUNK):
+    async with storage.connection() as db:
+        await db.execute("BEGIN")
+        start = await _one(db, "SELECT COALESCE(MAX(tx_id), 0) FROM balance_snapshots", ())
+        end = await _one(db, "SELECT COALESCE(MAX(id), 0) FROM transactions", ())
+        changed = await _one(db, SQL_CHANGED_USERS, (start[0], end[0]))
+        await db.rollback()
+
+        users = json.loads(changed[0])
+        count = 0
+        for offset in range(0, len(users), chunk_size):
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(SQL_TAKE_SNAPSHOTS, (json.dumps(users[offset:offset + chunk_size]), end[0]))
+            await db.commit()
+            count += cursor.rowcount
+        return count
+
+
+# Баланс пользователя на момент ts: от ближайшего снимка до ts прибавляются
+# операции после снимка, а если раннего снимка нет - от следующего снимка
+# (или текущего баланса) вычитаются операции после ts. Журнал целиком не читается.
+@instrumentation.timed("db.balance_at")
+async def balance_at(user_id, ts):
+    async with storage.connection() as db:
+        snapshot = await _one(db, SQL_SNAPSHOT_BEFORE, (user_id, ts))
+        if snapshot is not None:
+            total = await _one(db, SQL_SUM_AFTER, (user_id, snapshot["ts"], ts, snapshot["tx_id"]))
+            return snapshot["balance"] + total[0]
+
+        snapshot = await _one(db, SQL_SNAPSHOT_AFTER, (user_id, ts))
+        if snapshot is not None:
+            total = await _one(db, SQL_SUM_BETWEEN, (user_id, ts, snapshot["ts"], snapshot["tx_id"]))
+            return snapshot["balance"] - total[0]
+
+        # Чтение баланса и журнала в одной транзакции
+        await db.execute("BEGIN")
+        balance = await _one(db, storage.SQL_GET_BALANCE, (user_id,))
+        if balance is None:
+            return None
+        total = await _one(db, SQL_SUM_BETWEEN, (user_id, ts, float("inf"), 1 << 62))
+        await db.rollback()
+        return balance[0] - total[0]
+
+
+# Сверка: последний снимок плюс операции после него должны давать текущий баланс.
+# Возвращает (ожидаемый баланс, фактический) или None, если снимков нет.
+@instrumentation.timed("db.audit")
+async def audit(user_id):
+    async with storage.connection() as db:
+        await db.execute("BEGIN")
+        snapshot = await _one(db, SQL_LATEST_SNAPSHOT, (user_id,))
+        if snapshot is None:
+            await db.rollback()
+            return None
+        total = await _one(db, SQL_SUM_AFTER, (user_id, snapshot["ts"], float("inf"), snapshot["tx_id"]))
+        balance = await _one(db, storage.SQL_GET_BALANCE, (user_id,))
+        await db.rollback()
+    return snapshot["balance"] + total[0], balance[0]
+
+
+# Фоновые снимки балансов
+async def run_snapshots(interval=SNAPSHOT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            started = time.perf_counter()
+            count = await take_snapshots()
+            logging.info("Снимки балансов: %d за %.2f с", count, time.perf_counter() - started)
+        except Exception:
+            logging.exception("Ошибка при снимке балансов")
@@ -0,0 +1,179 @@
+import bisect
+import functools
+import json
+import logging
+import os
+import time
+
+# Эндпоинт /metrics слушает только локальный адрес; METRICS_PORT=0 - выключен
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Уровень и формат логов: text - для человека, json - одна запись на строку
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Верхние границы корзин гистограмм в секундах: от 10 мкс до ~20 с с шагом x1.5
+BUCKETS = tuple(10e-6 * 1.5 ** number for number in range(37))
+
+
+# Гистограмма длительностей этапа: счетчики по корзинам, сумма и число.
+# Наблюдение - бинарный поиск корзины и три сложения, без блокировок:
+# этапы измеряются в потоке своего цикла событий.
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля: линейная интерполяция внутри корзины
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+
+def histogram(stage):
+    found = _histograms.get(stage)
+    if found is None:
+        found = _histograms[stage] = Histogram()
+    return found
+
+
+# Декоратор корутины: время каждого вызова попадает в гистограмму этапа
+def timed(stage):
+    def decorate(fn):
+        observe = histogram(stage).observe
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+# Счетчики событий: спины, выигрыши, переводы
+def count(name, value=1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+# Показатели компонентов (пул, журнал спинов, планировщик отправки):
+# fn возвращает словарь чисел, он читается при каждом запросе /metrics
+def register_gauges(prefix, fn):
+    _gauges[prefix] = fn
+
+
+# p50/p99 по этапам, например для логов и бенчмарков
+def summary():
+    return {
+        stage: {"count": h.count, "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+        for stage, h in sorted(_histograms.items())
+    }
+
+
+# Обнулить замеры; гистограммы остаются на месте - на них ссылаются декораторы
+def reset():
+    for h in _histograms.values():
+        h.counts = [0] * (len(BUCKETS) + 1)
+        h.sum = 0.0
+        h.count = 0
+    _counters.clear()
+
+
+# Текст в формате Prometheus
+def render():
+    lines = ["# TYPE casino_stage_seconds histogram"]
+    for stage, h in sorted(_histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h.counts):
+            cumulative += count
+            lines.append(f'casino_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'casino_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+        lines.append(f'casino_stage_seconds_sum{{stage="{stage}"}} {h.sum:.9f}')
+        lines.append(f'casino_stage_seconds_count{{stage="{stage}"}} {h.count}')
+    for name, value in sorted(_counters.items()):
+        lines.append(f"# TYPE casino_{name}_total counter")
+        lines.append(f"casino_{name}_total {value}")
+    for prefix, fn in sorted(_gauges.items()):
+        try:
+            values = fn()
+        except Exception:
+            logging.exception("Ошибка при чтении показателей %s", prefix)
+            continue
+        for name, value in values.items():
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE casino_{prefix}_{name} gauge")
+                lines.append(f"casino_{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+# Отдельный HTTP-сервер с /metrics в текущем цикле событий.
+# Возвращает runner, который нужно закрыть через runner.cleanup().
+# aiohttp импортируется здесь: веб-приложению без METRICS_PORT он не нужен,
+# а его импорт - самая долгая часть холодного старта app.py
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики: http://%s:%d/metrics", host, port)
+    return runner
+
+
+# Запись лога одной JSON-строкой
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Настройка логов процесса. Сообщения ниже уровня отбрасываются до
+# форматирования, поэтому debug-записи на горячем пути почти ничего не стоят
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # aiosqlite на уровне DEBUG пишет каждый запрос с параметрами, включая хеши паролей
+    logging.getLogger("aiosqlite").setLevel(logging.INFO)
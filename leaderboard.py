@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from sortedcontainers import SortedList
+
+import storage
+
+# Как часто перечитывать таблицу целиком, чтобы подхватить записи
+# других процессов (бот и веб-приложение работают с одной базой)
+RESYNC_SECONDS = float(os.getenv("LEADERBOARD_RESYNC_SECONDS", "300"))
+
+SQL_LOAD = "SELECT user_id, username, balance FROM users"
+
+
+# Таблица лидеров в памяти процесса.
+# Ключи (-balance, user_id) лежат в SortedList, поэтому топ и страницы -
+# это срез, место игрока - бинарный поиск, а изменение баланса обновляет
+# одну позицию за O(log n) без сортировки всей таблицы.
+class Leaderboard:
+    def __init__(self, resync_seconds=RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self._keys = SortedList()
+        self._balances = {}
+        self._names = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        # Идущая загрузка и изменения, пришедшие во время нее
+        self._loading = None
+        self._pending = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    # Первый вызов ждет полной загрузки таблицы. Дальше раз в resync_seconds
+    # таблица перечитывается в фоне: читатели до замены видят прежний
+    # снимок, и одновременно идет не больше одной загрузки
+    async def ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.resync_seconds:
+            return
+        with self._lock:
+            task = self._loading
+            if task is None:
+                task = self._loading = asyncio.ensure_future(self._load())
+                task.add_done_callback(self._load_done)
+        if loaded_at is None:
+            await asyncio.shield(task)
+
+    async def _load(self):
+        try:
+            with self._lock:
+                self._pending = {}
+            async with storage.connection() as db:
+                async with db.execute(SQL_LOAD) as cursor:
+                    # Обычные кортежи вместо sqlite3.Row заметно ускоряют выборку
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+            keys = SortedList((-balance, user_id) for user_id, _, balance in rows)
+            balances = {user_id: balance for user_id, _, balance in rows}
+            names = {user_id: username for user_id, username, _ in rows}
+            with self._lock:
+                self._keys = keys
+                self._balances = balances
+                self._names = names
+                # Снимок мог быть прочитан раньше, чем записаны эти балансы
+                for user_id, (balance, username) in self._pending.items():
+                    self._set(user_id, balance, username)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._loading = None
+                self._pending = None
+
+    def _load_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Не удалось загрузить таблицу лидеров: %r", task.exception())
+
+    def _set(self, user_id, balance, username):
+        old = self._balances.get(user_id)
+        if old is not None:
+            self._keys.discard((-old, user_id))
+        self._keys.add((-balance, user_id))
+        self._balances[user_id] = balance
+        if username is not None:
+            self._names[user_id] = username
+
+    # Инкрементальное обновление после изменения баланса
+    def update(self, user_id, balance, username=None):
+        if balance is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = (balance, username)
+            if self.loaded:
+                self._set(user_id, balance, username)
+
+    def _rows(self, start, stop):
+        with self._lock:
+            keys = list(self._keys.islice(start, stop))
+            names = self._names
+            return [
+                {"rank": start + i + 1, "user_id": user_id, "username": names.get(user_id), "balance": -balance}
+                for i, (balance, user_id) in enumerate(keys)
+            ]
+
+    def top(self, n=10):
+        return self._rows(0, n)
+
+    # Страница таблицы, нумерация с 1
+    def page(self, number, per_page=10):
+        start = (max(number, 1) - 1) * per_page
+        return self._rows(start, start + per_page)
+
+    # Место игрока (с 1) или None, если его нет в таблице
+    def rank(self, user_id):
+        with self._lock:
+            balance = self._balances.get(user_id)
+            if balance is None:
+                return None
+            return self._keys.bisect_left((-balance, user_id)) + 1
+
+    def __len__(self):
+        return len(self._keys)
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+import instrumentation
+import storage
+
+# Политика сброса: не реже чем раз в FLUSH_MS миллисекунд или при BATCH записях
+FLUSH_MS = int(os.getenv("LEDGER_FLUSH_MS", "10"))
+MAX_BATCH = int(os.getenv("LEDGER_MAX_BATCH", "256"))
+MAX_QUEUE = int(os.getenv("LEDGER_MAX_QUEUE", "4096"))
+
+_STOP = object()
+
+# Соединения пула работают в WAL с synchronous=NORMAL, где коммит не делает
+# fsync и последние коммиты могут пропасть при сбое питания. На время
+# пачки соединение переключается в FULL: коммит пачки - один fsync журнала
+# WAL, и future завершается только после записи на диск
+SQL_SYNC_FULL = "PRAGMA synchronous=FULL"
+SQL_SYNC_DEFAULT = "PRAGMA synchronous=NORMAL"
+
+
+# Журнал результатов спинов с отложенной записью.
+# Спины копятся в очереди, фоновая задача записывает их пачкой в одной
+# транзакции (один fsync на пачку, см. SQL_SYNC_FULL), а каждый спин
+# получает future, который завершается только после коммита.
+class SpinLedger:
+    def __init__(self, flush_ms=FLUSH_MS, max_batch=MAX_BATCH, max_queue=MAX_QUEUE):
+        if max_batch < 1 or max_queue < 1:
+            raise ValueError("Размер пачки и очереди должен быть положительным")
+        self.flush_interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.batches = 0
+        self.spins = 0
+        self.rejected = 0
+        self._queue = None
+        self._full = None
+        self._task = None
+        # Фоновая задача завершилась: очередь больше никто не читает
+        self._closed = False
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # Очередь ограничена: при переполнении record() ждет (backpressure)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._full = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    # Новые записи отклоняются сразу, принятые до остановки записываются;
+    # ожидавшие места в очереди получают ошибку, а не ждут вечно
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(_STOP)
+        self._full.set()
+        await task
+
+    # Записать расчет ставки; возвращает баланс после коммита пачки
+    # или None, если на момент записи средств меньше ставки
+    @instrumentation.timed("ledger.record")
+    async def record(self, user_id, bet, payout):
+        if self._task is None:
+            raise RuntimeError("Журнал спинов не запущен")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_id, bet, payout, future))
+        # Место в очереди освободилось уже после остановки фоновой задачи:
+        # запись не будет прочитана
+        if self._closed:
+            self._fail_pending()
+        if self._queue.qsize() >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            # Ждем, пока наберется пачка или истечет интервал сброса
+            if self._queue.qsize() < self.max_batch - 1:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+
+            batch = [first]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Записи, которые ждали места в очереди, когда начался stop(), и те,
+        # что попадут в очередь позже (см. record), завершаются ошибкой
+        self._closed = True
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP and not item[-1].done():
+                item[-1].set_exception(RuntimeError("Журнал спинов остановлен"))
+
+    @instrumentation.timed("ledger.flush")
+    async def _flush(self, batch):
+        # Каждая ставка проверяется отдельно, коммит один на всю пачку.
+        # execute_fetchall - один переход в поток соединения на ставку: пока
+        # пачка пишется, база заблокирована для записи, и при загруженном
+        # цикле событий каждый лишний переход удлиняет блокировку
+        results = []
+        try:
+            async with storage.connection() as db:
+                await db.execute(SQL_SYNC_FULL)
+                try:
+                    for user_id, bet, payout, _ in batch:
+                        rows = await db.execute_fetchall(storage.SQL_SETTLE_BET, (payout, user_id, bet))
+                        results.append(rows[0][0] if rows else None)
+                    # Журнал операций пишется в той же транзакции, одним вызовом на пачку
+                    await db.executemany(storage.SQL_RECORD_TRANSACTION, [
+                        (user_id, storage.TX_BET, payout, None)
+                        for (user_id, _, payout, _), balance in zip(batch, results) if balance is not None
+                    ])
+                    await db.commit()
+                finally:
+                    if db.in_transaction:
+                        await db.rollback()
+                    await db.execute(SQL_SYNC_DEFAULT)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.spins += len(batch)
+        self.rejected += results.count(None)
+        for (*_, future), balance in zip(batch, results):
+            if not future.done():
+                future.set_result(balance)
+
+    def metrics(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "spins": self.spins,
+            "rejected": self.rejected,
+            "avg_batch": self.spins / self.batches if self.batches else 0.0,
+        }
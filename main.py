@@ -1,148 +1,256 @@
 import asyncio
 import logging
-import random
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-import aiosqlite
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
 import os
 from dotenv import load_dotenv
+import storage
+import migrations
+import instrumentation
+import fsm
+import history
+import miniapp
+import ui
+from fsm import BetStates
+from engine import engine, PAIR, TRIPLE
+from leaderboard import leaderboard
+from ledger import SpinLedger
+from throttling import SEND_GLOBAL_RATE, SendScheduler, ThrottlingMiddleware
+from webhook import WEBHOOK_URL, WEBHOOK_WORKERS, run_webhook
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: уровень LOG_LEVEL, формат LOG_FORMAT
+instrumentation.setup_logging()
 
 # Инициализация бота и диспетчера
 bot = Bot(token=os.getenv("BOT_TOKEN"))
-dp = Dispatcher()
+states = fsm.create_storage()
+dp = Dispatcher(storage=states)
 
-# Состояния для FSM
-class UserState:
-    WAITING_FOR_BET = "waiting_for_bet"
+# Защита от флуда: лимит обновлений на пользователя и очередь исходящих
+# сообщений в пределах ограничений Telegram
+throttling = ThrottlingMiddleware()
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+# Общий лимит отправки бота делится между процессами вебхука:
+# каждый планировщик видит только отправки своего процесса
+send_scheduler = SendScheduler(global_rate=SEND_GLOBAL_RATE / (max(WEBHOOK_WORKERS, 1) if WEBHOOK_URL else 1))
+bot.session.middleware(send_scheduler)
+# Готовые клавиатуры уходят в Telegram уже сериализованными
+prepared_markup = ui.PreparedMarkupMiddleware()
+bot.session.middleware(prepared_markup)
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Журнал спинов с групповым коммитом
+ledger = SpinLedger()
 
-# Символы для слотов
-SLOT_SYMBOLS = ["🍒", "🍊", "🍋", "🍇", "7️⃣", "💰"]
+# Показатели компонентов для /metrics
+instrumentation.register_gauges("pool", storage.pool_metrics)
+instrumentation.register_gauges("ledger", ledger.metrics)
+instrumentation.register_gauges("send", send_scheduler.metrics)
+instrumentation.register_gauges("throttle", throttling.limiter.metrics)
 
-# Инициализация базы данных
+# Наибольшее число спинов в одной автоигре
+AUTOPLAY_MAX_SPINS = int(os.getenv("AUTOPLAY_MAX_SPINS", "100"))
+
+# Фоновые задачи: очистка устаревших состояний и снимки балансов
+background_tasks = []
+
+# Инициализация базы данных: общие с веб-приложением миграции схемы
 async def init_db():
-    async with aiosqlite.connect("casino.db") as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER DEFAULT 1000
-            )
-        """)
-        await db.commit()
+    await migrations.migrate()
 
 # Обработчик команды /start
 @dp.message(Command("start"))
+@instrumentation.timed("handler.cmd_start")
 async def cmd_start(message: types.Message):
-    user_id = message.from_user.id
-    async with aiosqlite.connect("casino.db") as db:
-        await db.execute("INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, 1000)", (user_id,))
-        await db.commit()
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎰 Слоты", callback_data="slots")],
-        [InlineKeyboardButton(text="💰 Баланс", callback_data="balance")]
-    ])
-    
-    await message.answer(
-        "Добро пожаловать в казино! 🎲\n"
-        "Ваш начальный баланс: 1000 монет\n"
-        "Выберите игру:",
-        reply_markup=keyboard
-    )
+    await storage.telegram_user(message.from_user.id, message.from_user.username)
+    lang = ui.locale(message.from_user)
+    await message.answer(lang.text["start"], reply_markup=lang.start_keyboard)
 
 # Обработчик кнопки баланса
 @dp.callback_query(lambda c: c.data == "balance")
+@instrumentation.timed("handler.show_balance")
 async def show_balance(callback: types.CallbackQuery):
-    async with aiosqlite.connect("casino.db") as db:
-        async with db.execute("SELECT balance FROM users WHERE user_id = ?", (callback.from_user.id,)) as cursor:
-            balance = await cursor.fetchone()
-    
-    await callback.message.edit_text(f"Ваш баланс: {balance[0]} монет")
+    user_id = await storage.telegram_user(callback.from_user.id, callback.from_user.username)
+    balance = await storage.get_balance(user_id)
+    text = ui.locale(callback.from_user).text["balance"].format(balance=balance)
+    await callback.message.edit_text(text)
 
 # Обработчик кнопки слотов
 @dp.callback_query(lambda c: c.data == "slots")
+@instrumentation.timed("handler.play_slots")
 async def play_slots(callback: types.CallbackQuery):
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎰 Крутить", callback_data="spin_slots")]
-    ])
+    lang = ui.locale(callback.from_user)
     await callback.message.edit_text(
-        "🎰 Добро пожаловать в игру Слоты!\n"
-        "Нажмите кнопку 'Крутить', чтобы начать игру.",
-        reply_markup=keyboard
+        lang.text["slots"].format(max_spins=AUTOPLAY_MAX_SPINS), reply_markup=lang.slots_keyboard
     )
 
-# Обработчик кнопки крутить
+# Обработчик кнопки крутить: сообщение с кнопкой становится приглашением
+# ввести ставку, в нем же потом показывается результат
 @dp.callback_query(lambda c: c.data == "spin_slots")
-async def ask_bet(callback: types.CallbackQuery):
-    user_states[callback.from_user.id] = UserState.WAITING_FOR_BET
-    await callback.message.edit_text(
-        "Введите вашу ставку (целое число):"
-    )
+@instrumentation.timed("handler.ask_bet")
+async def ask_bet(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(BetStates.waiting_for_bet)
+    await state.set_data({"screen": callback.message.message_id})
+    await callback.message.edit_text(ui.locale(callback.from_user).text["ask_bet"])
 
-# Обработчик ввода ставки
-@dp.message()
-async def process_bet(message: types.Message):
-    if message.from_user.id not in user_states or user_states[message.from_user.id] != UserState.WAITING_FOR_BET:
+# Показ экрана правкой сообщения бота screen в чате message вместо нового
+# сообщения. Если править нечего (сообщение удалено или слишком старое),
+# отправляется новое. Возвращает id сообщения с экраном.
+async def show(message, screen, text, reply_markup=None):
+    if screen is not None:
+        try:
+            await message.bot.edit_message_text(
+                text=text, chat_id=message.chat.id, message_id=screen, reply_markup=reply_markup
+            )
+            return screen
+        except TelegramBadRequest as e:
+            # Тот же текст и клавиатура: экран уже такой, как нужно
+            if "message is not modified" in e.message:
+                return screen
+            logging.debug("Не удалось изменить сообщение %s: %s", screen, e.message)
+    sent = await message.answer(text, reply_markup=reply_markup)
+    return sent.message_id
+
+# Спин со ставкой bet и результат на экране screen. После спина ожидание
+# ставки снимается, как и раньше: случайное число в чате не становится
+# ставкой. Ставка остается в данных, и кнопка "Та же ставка" повторяет
+# ее - по одному вызову API на спин
+async def play_spin(message, user, state, screen, bet):
+    lang = ui.locale(user)
+    # Генерация и подсчет результата слотов
+    spin = engine.spin(bet)
+
+    # Проверка средств и обновление баланса одним выражением;
+    # ответ уходит только после коммита пачки
+    user_id = await storage.telegram_user(user.id, user.username)
+    balance = await ledger.record(user_id, bet, spin.payout)
+    if balance is None:
+        screen = await show(message, screen, lang.text["no_funds"])
+        await state.set_data({"screen": screen})
         return
+    leaderboard.update(user_id, balance)
+    instrumentation.count("spins")
+    if spin.kind in (TRIPLE, PAIR):
+        instrumentation.count("wins")
+
+    # Показ результатов
+    screen = await show(message, screen, lang.result(spin, bet, balance), lang.result_keyboard)
+    await state.set_state(None)
+    await state.set_data({"screen": screen, "bet": bet})
 
+# Обработчик команды /miniapp: кнопка открывает мини-приложение внутри
+# Telegram, его API работает в этом же процессе (miniapp.py)
+@dp.message(Command("miniapp"))
+@instrumentation.timed("handler.miniapp")
+async def cmd_miniapp(message: types.Message):
+    lang = ui.locale(message.from_user)
+    await message.answer(lang.miniapp, reply_markup=lang.miniapp_keyboard)
+
+# Автоигра: /autoplay 10 50 - 10 спинов по 50 монет.
+# Все исходы считаются одной пачкой, рассчитываются одной транзакцией
+# и присылаются одним сообщением; игра останавливается, когда не хватает средств.
+# Регистрируется раньше process_bet, чтобы команда работала и во время ввода ставки.
+@dp.message(Command("autoplay"))
+@instrumentation.timed("handler.autoplay")
+async def autoplay(message: types.Message, command: CommandObject):
+    lang = ui.locale(message.from_user)
+    try:
+        spins, bet = (int(value) for value in (command.args or "").split())
+    except ValueError:
+        await message.answer(lang.text["autoplay_usage"])
+        return
+    if not 0 < spins <= AUTOPLAY_MAX_SPINS or bet <= 0:
+        await message.answer(lang.text["autoplay_limits"].format(max_spins=AUTOPLAY_MAX_SPINS))
+        return
+
+    batch = engine.spin_many(spins, bet)
+    user_id = await storage.telegram_user(message.from_user.id, message.from_user.username)
+    played, total, balance = await storage.settle_spins(user_id, bet, batch.payouts.tolist())
+    if not played:
+        await message.answer(lang.text["no_funds"])
+        return
+    leaderboard.update(user_id, balance)
+
+    kinds = batch.kinds[:played]
+    triples = int((kinds == TRIPLE).sum())
+    pairs = int((kinds == PAIR).sum())
+    instrumentation.count("spins", played)
+    instrumentation.count("wins", triples + pairs)
+    await message.answer(lang.autoplay(played, spins, bet, triples, pairs, total, balance))
+
+# Обработчик ввода ставки
+@dp.message(BetStates.waiting_for_bet)
+@instrumentation.timed("handler.process_bet")
+async def process_bet(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    screen = data.get("screen")
     try:
         bet = int(message.text)
-        if bet <= 0:
-            await message.answer("Ставка должна быть положительным числом!")
+    except (TypeError, ValueError):
+        error = "not_a_number"
+    else:
+        if bet > 0:
+            await play_spin(message, message.from_user, state, screen, bet)
             return
+        error = "not_positive"
+    data["screen"] = await show(message, screen, ui.locale(message.from_user).text[error])
+    await state.set_data(data)
 
-        async with aiosqlite.connect("casino.db") as db:
-            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (message.from_user.id,)) as cursor:
-                balance = await cursor.fetchone()
-                if balance[0] < bet:
-                    await message.answer("У вас недостаточно средств!")
-                    return
-
-        # Генерация результатов слотов
-        results = [random.choice(SLOT_SYMBOLS) for _ in range(3)]
-        result_text = f"🎰 Результат: {' '.join(results)}"
-
-        # Проверка выигрыша
-        if results[0] == results[1] == results[2]:
-            win = bet * 3
-            result_text += f"\n🎉 Поздравляем! Вы выиграли {win} монет!"
-        elif results[0] == results[1] or results[1] == results[2] or results[0] == results[2]:
-            win = bet
-            result_text += f"\n🎉 Поздравляем! Вы выиграли {win} монет!"
-        else:
-            win = -bet
-            result_text += f"\n😢 К сожалению, вы проиграли {bet} монет."
-
-        # Обновление баланса
-        async with aiosqlite.connect("casino.db") as db:
-            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (win, message.from_user.id))
-            await db.commit()
-
-        # Показ результатов
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🎰 Крутить снова", callback_data="spin_slots")],
-            [InlineKeyboardButton(text="💰 Баланс", callback_data="balance")]
-        ])
-        
-        await message.answer(result_text, reply_markup=keyboard)
-        del user_states[message.from_user.id]
+# Повтор прошлой ставки кнопкой под результатом
+@dp.callback_query(lambda c: c.data == "spin_again")
+@instrumentation.timed("handler.spin_again")
+async def spin_again(callback: types.CallbackQuery, state: FSMContext):
+    bet = (await state.get_data()).get("bet")
+    if bet is None:
+        # Состояние истекло: ставку нужно ввести заново
+        await ask_bet(callback, state)
+        return
+    await play_spin(callback.message, callback.from_user, state, callback.message.message_id, bet)
 
-    except ValueError:
-        await message.answer("Пожалуйста, введите корректное число!")
+# Подготовка и остановка общие для polling и вебхука
+@dp.startup()
+async def on_startup(serve_miniapp: bool = False):
+    await init_db()
+    await ledger.start()
+    background_tasks.append(asyncio.create_task(states.run_expiry()))
+    background_tasks.append(asyncio.create_task(history.run_snapshots()))
+    # При long polling у API мини-приложения свой порт; он открывается после
+    # запуска журнала спинов и закрывается раньше его остановки.
+    # В режиме вебхука маршруты API добавлены в приложение вебхука
+    if serve_miniapp:
+        dp["miniapp_runner"] = await miniapp.start_server(bot, ledger)
+
+@dp.shutdown()
+async def on_shutdown():
+    runner = dp.workflow_data.pop("miniapp_runner", None)
+    if runner is not None:
+        await runner.cleanup()
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await ledger.stop()
+    await storage.close_pool()
 
 # Запуск бота
 async def main():
-    await init_db()
-    await dp.start_polling(bot)
+    # Если раньше работал вебхук, Telegram не отдаст обновления через getUpdates
+    await bot.delete_webhook()
+    metrics = await instrumentation.start_server() if instrumentation.METRICS_PORT else None
+    try:
+        await dp.start_polling(bot, serve_miniapp=bool(miniapp.MINIAPP_PORT))
+    finally:
+        if metrics is not None:
+            await metrics.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # С WEBHOOK_URL бот принимает обновления через вебхук, иначе - long polling.
+    # Все команды, включая /miniapp, и API мини-приложения обслуживает один цикл событий
+    if WEBHOOK_URL:
+        run_webhook(dp, bot, setup_app=lambda app: miniapp.setup(app, bot, ledger))
+    else:
+        asyncio.run(main()) 
\ No newline at end of file
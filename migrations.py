@@ -0,0 +1,141 @@
+import logging
+
+import sessions
+import storage
+
+# Единая таблица пользователей бота и веб-приложения.
+# Пользователь бота связан с Telegram через telegram_id, у пользователя
+# веб-приложения есть username и пароль; у одной записи может быть и то, и другое.
+SQL_CREATE_USERS = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE,
+        password TEXT,
+        balance INTEGER NOT NULL DEFAULT 1000,
+        first_name TEXT,
+        last_name TEXT,
+        telegram_username TEXT,
+        telegram_id INTEGER
+    )
+"""
+USER_COLUMNS = (
+    "user_id", "username", "password", "balance",
+    "first_name", "last_name", "telegram_username", "telegram_id",
+)
+
+
+async def _columns(db, table):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row["name"]: row["notnull"] for row in await cursor.fetchall()}
+
+
+# 1: приводит таблицу users бота (user_id, balance) или веб-приложения
+# (username NOT NULL) к единой схеме. SQLite не умеет менять ограничения
+# столбцов, поэтому старая таблица копируется в новую.
+async def unify_users(db):
+    columns = await _columns(db, "users")
+    if not columns:
+        await db.execute(SQL_CREATE_USERS.format(table="users"))
+        return
+    if "telegram_id" in columns and not columns.get("username"):
+        return
+
+    await db.execute("DROP TABLE IF EXISTS users_new")
+    await db.execute(SQL_CREATE_USERS.format(table="users_new"))
+    shared = ", ".join(column for column in USER_COLUMNS if column in columns)
+    await db.execute(f"INSERT INTO users_new ({shared}) SELECT {shared} FROM users")
+    # В таблице бота user_id - это id пользователя Telegram
+    await db.execute("UPDATE users_new SET telegram_id = user_id WHERE username IS NULL AND telegram_id IS NULL")
+    await db.execute("DROP TABLE users")
+    await db.execute("ALTER TABLE users_new RENAME TO users")
+
+
+# 2: индексы для поиска по имени, Telegram id и топа по балансу
+async def index_users(db):
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_telegram_id ON users (telegram_id)")
+    await db.execute(storage.SQL_BALANCE_INDEX)
+
+
+# 3: серверные сессии веб-приложения
+async def create_sessions(db):
+    await db.execute(sessions.SQL_CREATE_SESSIONS)
+    await db.execute(sessions.SQL_SESSIONS_INDEX)
+
+
+# 4: состояния диалогов бота для хранилища fsm.SQLiteStorage
+async def create_fsm_states(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires_at ON fsm_states (expires_at)")
+
+
+# 5: журнал операций с балансом и периодические снимки балансов (history.py)
+async def create_transactions(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            kind TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            counterparty INTEGER
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (user_id, ts)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER NOT NULL,
+            tx_id INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            balance INTEGER NOT NULL,
+            PRIMARY KEY (user_id, tx_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_balance_snapshots_tx_id ON balance_snapshots (tx_id)")
+
+
+# Миграции по порядку; номер версии схемы - позиция в списке, начиная с 1.
+# Версия хранится в PRAGMA user_version, новые миграции добавляются в конец.
+MIGRATIONS = (
+    unify_users,
+    index_users,
+    create_sessions,
+    create_fsm_states,
+    create_transactions,
+)
+LATEST_VERSION = len(MIGRATIONS)
+
+_current = False
+
+
+async def schema_version(db):
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+# Применить недостающие миграции. Проверка версии - одно чтение PRAGMA,
+# поэтому холодный старт с актуальной схемой не выполняет DDL вовсе.
+# BEGIN IMMEDIATE не дает боту и веб-приложению мигрировать одновременно.
+async def migrate():
+    global _current
+    if _current:
+        return LATEST_VERSION
+    async with storage.connection() as db:
+        version = await schema_version(db)
+        if version < LATEST_VERSION:
+            await db.execute("BEGIN IMMEDIATE")
+            version = await schema_version(db)
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logging.info("Миграция схемы %d: %s", number, migration.__name__)
+                await migration(db)
+                await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+            version = LATEST_VERSION
+    _current = True
+    return version
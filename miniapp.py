@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import time
+
+from aiohttp import web
+from aiogram.utils.web_app import safe_parse_webapp_init_data
+
+import history
+import instrumentation
+import storage
+from engine import engine, PAIR, TRIPLE
+from leaderboard import leaderboard
+
+# JSON API мини-приложения. В режиме вебхука маршруты живут в том же
+# aiohttp-приложении, что и вебхук; при long polling API слушает
+# MINIAPP_PORT (0 - выключено) в цикле событий бота
+MINIAPP_HOST = os.getenv("MINIAPP_HOST", "0.0.0.0")
+MINIAPP_PORT = int(os.getenv("MINIAPP_PORT", "0"))
+MINIAPP_PREFIX = os.getenv("MINIAPP_PREFIX", "/api")
+# Сколько секунд действительны данные запуска мини-приложения
+MINIAPP_AUTH_TTL = float(os.getenv("MINIAPP_AUTH_TTL", "86400"))
+
+
+def _error(exception, text):
+    return exception(text=json.dumps({"error": text}, ensure_ascii=False), content_type="application/json")
+
+
+def _json(data):
+    return web.json_response(data, dumps=lambda value: json.dumps(value, ensure_ascii=False))
+
+
+# Пользователь запроса. Мини-приложение передает данные запуска Telegram
+# (initData) в заголовке "Authorization: tma <initData>"; подпись проверяется
+# токеном бота, поэтому user_id в адресе или теле запроса не нужен.
+# Возвращает user_id в базе казино.
+async def _user(request):
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("tma "):
+        raise _error(web.HTTPUnauthorized, "Нет данных запуска мини-приложения")
+    try:
+        init_data = safe_parse_webapp_init_data(request.app["miniapp_bot"].token, header[4:])
+    except ValueError:
+        raise _error(web.HTTPUnauthorized, "Неверная подпись данных запуска")
+    if init_data.user is None or time.time() - init_data.auth_date.timestamp() > MINIAPP_AUTH_TTL:
+        raise _error(web.HTTPUnauthorized, "Данные запуска устарели")
+    return await storage.telegram_user(init_data.user.id, init_data.user.username)
+
+
+# Баланс и место в таблице лидеров
+@instrumentation.timed("api.me")
+async def handle_me(request):
+    user_id = await _user(request)
+    balance = await storage.get_balance(user_id)
+    await leaderboard.ensure_loaded()
+    return _json({"user_id": user_id, "balance": balance, "rank": leaderboard.rank(user_id)})
+
+
+# Спин слотов: {"bet": 10}. Расчет идет через журнал спинов бота
+@instrumentation.timed("api.spin")
+async def handle_spin(request):
+    user_id = await _user(request)
+    try:
+        bet = int((await request.json())["bet"])
+    except (ValueError, TypeError, KeyError):
+        raise _error(web.HTTPBadRequest, "Ставка должна быть целым числом")
+    if bet <= 0:
+        raise _error(web.HTTPBadRequest, "Ставка должна быть положительным числом!")
+
+    spin = engine.spin(bet)
+    balance = await request.app["miniapp_ledger"].record(user_id, bet, spin.payout)
+    if balance is None:
+        raise _error(web.HTTPConflict, "У вас недостаточно средств!")
+    leaderboard.update(user_id, balance)
+    instrumentation.count("spins")
+    if spin.kind in (TRIPLE, PAIR):
+        instrumentation.count("wins")
+    return _json({"symbols": spin.symbols, "payout": spin.payout, "balance": balance})
+
+
+# Страница таблицы лидеров: ?page=1
+@instrumentation.timed("api.top")
+async def handle_top(request):
+    await _user(request)
+    try:
+        page = int(request.query.get("page", "1"))
+    except ValueError:
+        raise _error(web.HTTPBadRequest, "Номер страницы должен быть числом")
+    await leaderboard.ensure_loaded()
+    return _json({"players": leaderboard.page(page)})
+
+
+# Страница истории операций: ?before=<ts>,<id> - курсор из предыдущей страницы
+@instrumentation.timed("api.history")
+async def handle_history(request):
+    user_id = await _user(request)
+    before = request.query.get("before")
+    if before:
+        try:
+            ts, tx_id = before.split(",")
+            before = (float(ts), int(tx_id))
+        except ValueError:
+            raise _error(web.HTTPBadRequest, "Неверный курсор истории")
+    entries, cursor = await history.history(user_id, before=before)
+    return _json({"entries": entries, "next": f"{cursor[0]!r},{cursor[1]}" if cursor else None})
+
+
+# Маршруты API в приложении app: bot проверяет подпись данных запуска,
+# ledger - журнал спинов процесса бота (общий пул соединений и пачки коммитов)
+def setup(app, bot, ledger, prefix=MINIAPP_PREFIX):
+    app["miniapp_bot"] = bot
+    app["miniapp_ledger"] = ledger
+    app.router.add_get(f"{prefix}/me", handle_me)
+    app.router.add_post(f"{prefix}/spin", handle_spin)
+    app.router.add_get(f"{prefix}/top", handle_top)
+    app.router.add_get(f"{prefix}/history", handle_history)
+
+
+# Отдельный сервер API в текущем цикле событий (режим long polling).
+# Возвращает runner, который нужно закрыть через runner.cleanup()
+async def start_server(bot, ledger, host=MINIAPP_HOST, port=MINIAPP_PORT):
+    app = web.Application()
+    setup(app, bot, ledger)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("API мини-приложения: http://%s:%d%s", host, port, MINIAPP_PREFIX)
+    return runner
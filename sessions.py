@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+
+import instrumentation
+import storage
+from cache import TTLCache
+
+# Сессия истекает, если ей не пользовались SESSION_TTL секунд
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "100000"))
+EXPIRY_INTERVAL = float(os.getenv("SESSION_EXPIRY_INTERVAL", "60"))
+
+SQL_CREATE_SESSIONS = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        token TEXT PRIMARY KEY,
+        user_data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+"""
+SQL_SESSIONS_INDEX = "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)"
+
+
+# Хранилище сессий по непрозрачному токену.
+# Сессии лежат в таблице sessions, перед ней - LRU-кэш в памяти, поэтому
+# повторные обращения не трогают диск. Срок жизни скользящий: в базе он
+# продлевается только когда прошло больше половины, чтобы не писать на каждый запрос.
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, cache_size=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=cache_size, ttl=ttl)
+
+    @instrumentation.timed("db.session_create")
+    async def create(self, user_data):
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl
+        async with storage.connection() as db:
+            await db.execute(
+                "INSERT INTO sessions (token, user_data, expires_at) VALUES (?, ?, ?)",
+                (token, json.dumps(user_data), expires_at),
+            )
+            await db.commit()
+        self._cache.set(token, (user_data, expires_at))
+        return token
+
+    # Данные сессии или None, если токен неизвестен или истек
+    @instrumentation.timed("db.session_get")
+    async def get(self, token):
+        now = time.time()
+        cached = self._cache.get(token)
+        if cached is None:
+            async with storage.connection() as db:
+                async with db.execute(
+                    "SELECT user_data, expires_at FROM sessions WHERE token = ?", (token,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            if row is None or row["expires_at"] <= now:
+                return None
+            cached = (json.loads(row["user_data"]), row["expires_at"])
+
+        # Срок сессии проверяется и для записи из кэша: запись кэша
+        # продлевается при каждом set и может пережить саму сессию
+        user_data, expires_at = cached
+        if expires_at <= now:
+            self._cache.invalidate(token)
+            return None
+        if expires_at - now < self.ttl / 2:
+            expires_at = now + self.ttl
+            async with storage.connection() as db:
+                cursor = await db.execute(
+                    "UPDATE sessions SET expires_at = ? WHERE token = ? AND expires_at > ?", (expires_at, token, now)
+                )
+                await db.commit()
+            # Строки уже нет: сессию удалили (выход, очистка истекших)
+            if cursor.rowcount == 0:
+                self._cache.invalidate(token)
+                return None
+        self._cache.set(token, (user_data, expires_at))
+        return user_data
+
+    @instrumentation.timed("db.session_delete")
+    async def delete(self, token):
+        self._cache.invalidate(token)
+        async with storage.connection() as db:
+            await db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            await db.commit()
+
+    async def purge_expired(self):
+        async with storage.connection() as db:
+            cursor = await db.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            await db.commit()
+            return cursor.rowcount
+
+    # Фоновое удаление истекших сессий
+    async def run_expiry(self, interval=EXPIRY_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logging.exception("Ошибка при удалении истекших сессий")
+
+    def metrics(self):
+        return self._cache.metrics()
+
+
+session_store = SessionStore()
@@ -0,0 +1,153 @@
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from engine import (
+    GameEngine, SLOT_SYMBOLS, REELS, TRIPLE_MULTIPLIER, PAIR_MULTIPLIER,
+    ROULETTE_NUMBERS, ROULETTE_MULTIPLIER,
+)
+
+# Квантиль нормального распределения для 95% доверительного интервала
+Z95 = 1.959963984540054
+# Номера потоков ГПСЧ: RTP и разорение с одним seed получают разные
+# дочерние последовательности, а не одни и те же исходы
+RTP_STREAM = 0
+RUIN_STREAM = 1
+
+
+# Точные значения для сравнения с симуляцией: (RTP, частота выигрыша, дисперсия)
+# на единичную ставку; RTP = возвращено игроку / поставлено
+def exact_slots():
+    outcomes = []
+    for reels in itertools.product(range(len(SLOT_SYMBOLS)), repeat=REELS):
+        a, b, c = reels
+        if a == b == c:
+            outcomes.append(TRIPLE_MULTIPLIER)
+        elif a == b or b == c or a == c:
+            outcomes.append(PAIR_MULTIPLIER)
+        else:
+            outcomes.append(-1)
+    return _exact(outcomes)
+
+
+def exact_roulette(numbers):
+    hits = len(set(numbers))
+    return _exact([ROULETTE_MULTIPLIER] * hits + [-1] * (ROULETTE_NUMBERS - hits))
+
+
+def _exact(outcomes):
+    n = len(outcomes)
+    mean = sum(outcomes) / n
+    variance = sum((x - mean) ** 2 for x in outcomes) / n
+    return {"rtp": 1 + mean, "hit_frequency": sum(x > 0 for x in outcomes) / n, "variance": variance}
+
+
+def _net_outcomes(engine, game, n, numbers):
+    # Чистый результат спина в единицах ставки
+    if game == "slots":
+        return engine.spin_many(n, 1).payouts
+    return engine.roulette_many(n, 1, numbers).payouts
+
+
+# Один кусок симуляции RTP; выполняется в процессе пула
+def rtp_chunk(game, n, seed, numbers=()):
+    engine = GameEngine(seed)
+    started = time.perf_counter()
+    net = _net_outcomes(engine, game, n, numbers)
+    elapsed = time.perf_counter() - started
+    return {
+        "spins": n,
+        "sum": int(net.sum()),
+        "sum_sq": int(np.square(net, dtype=np.int64).sum()),
+        "hits": int((net > 0).sum()),
+        "seconds": elapsed,
+    }
+
+
+# Кусок симуляции разорения: paths игроков с банкроллом bankroll ставок
+# играют horizon спинов; возвращает число разорившихся к каждой контрольной точке
+def ruin_chunk(game, paths, horizon, bankroll, checkpoints, seed, numbers=()):
+    engine = GameEngine(seed)
+    net = _net_outcomes(engine, game, paths * horizon, numbers).reshape(paths, horizon).astype(np.int32)
+    balance = bankroll + np.cumsum(net, axis=1, dtype=np.int32)
+    # Игрок разорен, когда не может оплатить следующую ставку
+    broke = balance < 1
+    ruined_at = np.where(broke.any(axis=1), broke.argmax(axis=1) + 1, horizon + 1)
+    return [int((ruined_at <= t).sum()) for t in checkpoints]
+
+
+def _seeds(seed, stream, n):
+    return np.random.SeedSequence(seed, spawn_key=(stream,)).spawn(n)
+
+
+def _chunks(total, size):
+    while total > 0:
+        yield min(size, total)
+        total -= size
+
+
+def simulate_rtp(game, spins, chunk=1_000_000, workers=None, seed=None, numbers=()):
+    sizes = list(_chunks(spins, chunk))
+    seeds = _seeds(seed, RTP_STREAM, len(sizes))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(pool.map(rtp_chunk, [game] * len(sizes), sizes, seeds, [numbers] * len(sizes)))
+    wall = time.perf_counter() - started
+
+    n = sum(part["spins"] for part in parts)
+    mean = sum(part["sum"] for part in parts) / n
+    variance = sum(part["sum_sq"] for part in parts) / n - mean ** 2
+    hit_frequency = sum(part["hits"] for part in parts) / n
+    rtp_std_error = math.sqrt(variance / n)
+    rtp_half_width = Z95 * rtp_std_error
+    hit_half_width = Z95 * math.sqrt(hit_frequency * (1 - hit_frequency) / n)
+    return {
+        "spins": n,
+        "rtp": 1 + mean,
+        "rtp_ci95": [1 + mean - rtp_half_width, 1 + mean + rtp_half_width],
+        "rtp_std_error": rtp_std_error,
+        "house_edge": -mean,
+        "hit_frequency": hit_frequency,
+        "hit_frequency_ci95": [hit_frequency - hit_half_width, hit_frequency + hit_half_width],
+        "variance": variance,
+        "std_dev": math.sqrt(variance),
+        "throughput": {
+            "wall_seconds": wall,
+            "spins_per_second": n / wall,
+            "engine_spins_per_second_per_worker": n / sum(part["seconds"] for part in parts),
+            "workers": workers or os.cpu_count(),
+        },
+    }
+
+
+def simulate_ruin(game, paths, horizon, bankroll, points=10, chunk=2000, workers=None, seed=None, numbers=()):
+    checkpoints = sorted({max(1, horizon * i // points) for i in range(1, points + 1)})
+    sizes = list(_chunks(paths, chunk))
+    seeds = _seeds(seed, RUIN_STREAM, len(sizes))
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(pool.map(
+            ruin_chunk, [game] * len(sizes), sizes, [horizon] * len(sizes), [bankroll] * len(sizes),
+            [checkpoints] * len(sizes), seeds, [numbers] * len(sizes),
+        ))
+
+    curve = []
+    for i, spins in enumerate(checkpoints):
+        ruined = sum(part[i] for part in parts)
+        low, high = wilson_interval(ruined, paths)
+        curve.append({"spins": spins, "ruin_probability": ruined / paths, "ci95": [low, high]})
+    return {"paths": paths, "horizon": horizon, "bankroll_bets": bankroll, "curve": curve}
+
+
+# Доверительный интервал Уилсона для доли
+def wilson_interval(successes, n, z=Z95):
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
@@ -0,0 +1,465 @@
+import asyncio
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+import instrumentation
+from cache import TTLCache
+
+# Путь к базе и размер пула можно переопределить через переменные окружения
+DB_PATH = os.getenv("CASINO_DB", "casino.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+# Настройки, которые применяются к каждому соединению пула
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Запросы используют RETURNING (SQLite 3.35) и UPDATE ... FROM (3.33)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Размер кэша подготовленных выражений sqlite3 на соединение
+STATEMENT_CACHE_SIZE = 128
+
+# Запросы держим константами, чтобы кэш выражений всегда попадал
+SQL_GET_BALANCE = "SELECT balance FROM users WHERE user_id = ?"
+SQL_APPLY_DELTA = "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance"
+SQL_SETTLE_BET = (
+    "UPDATE users SET balance = balance + ? "
+    "WHERE user_id = ? AND balance >= ? RETURNING balance"
+)
+SQL_TOP_N = "SELECT * FROM users ORDER BY balance DESC LIMIT ?"
+# Запись журнала операций. Время ставит SQLite при выполнении и не меньше
+# времени последней записи: если системные часы отстанут, ts все равно не
+# убывает вместе с id, и границы по ts в history.py ничего не отбрасывают
+SQL_RECORD_TRANSACTION = (
+    "INSERT INTO transactions (user_id, ts, kind, amount, counterparty) "
+    "VALUES (?, MAX((julianday('now') - 2440587.5) * 86400.0, "
+    "COALESCE((SELECT ts FROM transactions ORDER BY id DESC LIMIT 1), 0)), ?, ?, ?)"
+)
+# Получатели переводов по именам одним запросом: имена передаются JSON-массивом
+SQL_FIND_USERS = "SELECT username, user_id FROM users WHERE username IN (SELECT value FROM json_each(?))"
+# Зачисление всем получателям пачки одним выражением; пары [user_id, сумма]
+# одного получателя складываются
+SQL_CREDIT_MANY = """
+    UPDATE users SET balance = balance + credit.amount
+    FROM (SELECT json_extract(value, '$[0]') AS user_id, SUM(json_extract(value, '$[1]')) AS amount
+          FROM json_each(?) GROUP BY 1) credit
+    WHERE users.user_id = credit.user_id
+    RETURNING users.user_id, users.balance
+"""
+SQL_BALANCE_INDEX = "CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC, user_id)"
+SQL_TELEGRAM_USER = (
+    "INSERT INTO users (telegram_id, telegram_username, balance) VALUES (?, ?, ?) "
+    "ON CONFLICT (telegram_id) DO UPDATE SET "
+    "telegram_username = COALESCE(excluded.telegram_username, telegram_username) "
+    "RETURNING user_id"
+)
+SQL_CREATE_USER = (
+    "INSERT INTO users (username, password, first_name, last_name, telegram_username, balance) "
+    "VALUES (?, ?, ?, ?, ?, ?) RETURNING user_id"
+)
+SQL_CREATE_USERS = (
+    "INSERT OR IGNORE INTO users (username, password, first_name, last_name, telegram_username, balance) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+# Виды операций в журнале transactions
+TX_BET = "bet"
+TX_AUTOPLAY = "autoplay"
+TX_TRANSFER = "transfer"
+TX_ADJUST = "adjust"
+
+# Перевод невозможен: получатель не найден, средств недостаточно и т.п.
+# Текст ошибки можно показывать пользователю
+class TransferError(Exception):
+    pass
+
+
+# Пароль-заглушка для импортированных пользователей: не совпадает ни с одним хешем,
+# войти по паролю нельзя, пока он не задан
+UNUSABLE_PASSWORD = "!"
+
+
+# Счетчики пула соединений
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        self.hold_time = 0.0
+
+
+# Ограниченный пул долгоживущих соединений.
+# Пул не привязан к конкретному циклу событий: ожидающие получают соединение
+# через call_soon_threadsafe, поэтому им можно пользоваться и из asyncio.run
+# в потоках Streamlit, и из цикла бота.
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        if size < 1:
+            raise ValueError("Размер пула должен быть положительным")
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                f"Нужен SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} или новее, "
+                f"Python собран с {sqlite3.sqlite_version}"
+            )
+        self.path = path
+        self.size = size
+        self.stats = PoolStats()
+        self._idle = collections.deque()
+        self._waiters = collections.deque()
+        self._opened = 0
+        self._in_use = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    async def _connect(self):
+        db = aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        # Потоки соединений не должны мешать завершению процесса,
+        # если пул не закрыт явно (Streamlit его не закрывает)
+        db.daemon = True
+        await db
+        db.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def acquire(self):
+        started = time.perf_counter()
+        waiter = None
+        db = None
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Пул соединений закрыт")
+            if self._idle:
+                db = self._idle.pop()
+                self._in_use += 1
+            elif self._opened < self.size:
+                self._opened += 1
+                self._in_use += 1
+            else:
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            try:
+                db = await waiter
+            except asyncio.CancelledError:
+                # Соединение могло быть передано уже после отмены
+                if waiter.done() and not waiter.cancelled():
+                    self.release(waiter.result())
+                raise
+        elif db is None:
+            try:
+                db = await self._connect()
+            except BaseException:
+                with self._lock:
+                    self._opened -= 1
+                    self._in_use -= 1
+                raise
+
+        elapsed = time.perf_counter() - started
+        stats = self.stats
+        with self._lock:
+            stats.checkouts += 1
+            stats.checkout_time += elapsed
+            stats.max_checkout_time = max(stats.max_checkout_time, elapsed)
+            if waiter is not None:
+                stats.waits += 1
+                stats.wait_time += elapsed
+                stats.max_wait_time = max(stats.max_wait_time, elapsed)
+        return db
+
+    def release(self, db):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter, db)
+                    return
+            self._in_use -= 1
+            if self._closed:
+                self._opened -= 1
+                discard = True
+            else:
+                self._idle.append(db)
+                discard = False
+        if discard:
+            asyncio.ensure_future(db.close())
+
+    def _hand_over(self, waiter, db):
+        if waiter.done():
+            self.release(db)
+        else:
+            waiter.set_result(db)
+
+    # Выдача соединения на время блока; незавершенная транзакция откатывается
+    @asynccontextmanager
+    async def connection(self):
+        db = await self.acquire()
+        taken = time.perf_counter()
+        try:
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            finally:
+                self.stats.hold_time += time.perf_counter() - taken
+                self.release(db)
+
+    def metrics(self):
+        stats = self.stats
+        with self._lock:
+            checkouts = stats.checkouts
+            return {
+                "size": self.size,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": len(self._waiters),
+                "checkouts": checkouts,
+                "waits": stats.waits,
+                "wait_time_total": stats.wait_time,
+                "wait_time_max": stats.max_wait_time,
+                "checkout_latency_avg": stats.checkout_time / checkouts if checkouts else 0.0,
+                "checkout_latency_max": stats.max_checkout_time,
+                "hold_time_avg": stats.hold_time / checkouts if checkouts else 0.0,
+            }
+
+    async def close(self):
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+        for db in idle:
+            await db.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Общий пул процесса
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+def connection():
+    return get_pool().connection()
+
+
+def pool_metrics():
+    return get_pool().metrics()
+
+
+# Баланс пользователя или None, если пользователя нет
+@instrumentation.timed("db.get_balance")
+async def get_balance(user_id):
+    async with connection() as db:
+        async with db.execute(SQL_GET_BALANCE, (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+# Изменение баланса на delta с записью в журнал; возвращает новый баланс или None
+@instrumentation.timed("db.apply_delta")
+async def apply_delta(user_id, delta, kind=TX_ADJUST):
+    async with connection() as db:
+        rows = await db.execute_fetchall(SQL_APPLY_DELTA, (delta, user_id))
+        if rows:
+            await db.execute(SQL_RECORD_TRANSACTION, (user_id, kind, delta, None))
+        await db.commit()
+    return rows[0][0] if rows else None
+
+
+# Расчет ставки одним выражением: проверка средств и выплата атомарны,
+# запись в журнал - в той же транзакции.
+# payout - итоговое изменение баланса (отрицательное при проигрыше).
+# Возвращает новый баланс или None, если средств меньше ставки.
+@instrumentation.timed("db.settle_bet")
+async def settle_bet(user_id, bet, payout):
+    async with connection() as db:
+        rows = await db.execute_fetchall(SQL_SETTLE_BET, (payout, user_id, bet))
+        if rows:
+            await db.execute(SQL_RECORD_TRANSACTION, (user_id, TX_BET, payout, None))
+        await db.commit()
+    return rows[0][0] if rows else None
+
+
+# Серия спинов одной транзакцией: спины засчитываются по порядку, пока перед
+# очередным спином на балансе не меньше ставки. BEGIN IMMEDIATE сразу берет
+# блокировку записи, поэтому баланс не меняется между чтением и записью.
+# payouts - изменения баланса по спинам. Возвращает (число сыгранных спинов,
+# их суммарный итог, новый баланс) или None, если пользователя нет.
+@instrumentation.timed("db.settle_spins")
+async def settle_spins(user_id, bet, payouts):
+    async with connection() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        rows = await db.execute_fetchall(SQL_GET_BALANCE, (user_id,))
+        if not rows:
+            return None
+        balance = rows[0][0]
+        played = total = 0
+        for payout in payouts:
+            if balance + total < bet:
+                break
+            total += payout
+            played += 1
+        if played:
+            rows = await db.execute_fetchall(SQL_APPLY_DELTA, (total, user_id))
+            balance = rows[0][0]
+            await db.execute(SQL_RECORD_TRANSACTION, (user_id, TX_AUTOPLAY, total, None))
+        await db.commit()
+    return played, total, balance
+
+
+# Топ игроков по балансу
+@instrumentation.timed("db.top_n")
+async def top_n(n=10):
+    async with connection() as db:
+        async with db.execute(SQL_TOP_N, (n,)) as cursor:
+            rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+# Перевод средств по имени получателя одной транзакцией.
+# Возвращает (баланс отправителя, user_id получателя, баланс получателя);
+# если перевод невозможен, выбрасывает TransferError.
+@instrumentation.timed("db.transfer")
+async def transfer(from_user_id, recipient, amount):
+    sender, recipients, balances = await transfer_many(from_user_id, [(recipient, amount)])
+    to_user_id = recipients[recipient]
+    return sender, to_user_id, balances[to_user_id]
+
+
+# Выплаты нескольким получателям одной транзакцией: все или ничего.
+# payouts - пары (имя получателя, сумма). Поиск получателей, проверка
+# средств, списание, зачисление и журнал идут под одной блокировкой записи
+# (BEGIN IMMEDIATE), поэтому встречные переводы просто выполняются по
+# очереди: взаимной блокировки нет, а баланс не меняется между проверкой и
+# списанием. Возвращает (баланс отправителя, {имя: user_id}, {user_id: баланс}).
+@instrumentation.timed("db.transfer_many")
+async def transfer_many(from_user_id, payouts):
+    payouts = [(recipient, int(amount)) for recipient, amount in payouts]
+    if not payouts:
+        raise TransferError("Не указаны получатели")
+    if any(amount <= 0 for _, amount in payouts):
+        raise TransferError("Сумма перевода должна быть положительной")
+    total = sum(amount for _, amount in payouts)
+    names = list({recipient for recipient, _ in payouts})
+
+    async with connection() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        rows = await db.execute_fetchall(SQL_FIND_USERS, (json.dumps(names),))
+        recipients = {row[0]: row[1] for row in rows}
+        missing = [name for name in names if name not in recipients]
+        if missing:
+            raise TransferError(f"Пользователь не найден: {', '.join(missing)}")
+        if from_user_id in recipients.values():
+            raise TransferError("Нельзя перевести средства самому себе")
+
+        rows = await db.execute_fetchall(SQL_SETTLE_BET, (-total, from_user_id, total))
+        if not rows:
+            raise TransferError("Недостаточно средств")
+        sender = rows[0][0]
+
+        credits = [(recipients[recipient], amount) for recipient, amount in payouts]
+        rows = await db.execute_fetchall(SQL_CREDIT_MANY, (json.dumps(credits),))
+        balances = {row[0]: row[1] for row in rows}
+        entries = []
+        for to_user_id, amount in credits:
+            entries.append((from_user_id, TX_TRANSFER, -amount, to_user_id))
+            entries.append((to_user_id, TX_TRANSFER, amount, from_user_id))
+        await db.executemany(SQL_RECORD_TRANSACTION, entries)
+        await db.commit()
+    instrumentation.count("transfers", len(payouts))
+    return sender, recipients, balances
+
+
+# Соответствие Telegram id -> user_id не меняется, поэтому кэшируется без срока
+_telegram_users = TTLCache(maxsize=int(os.getenv("TELEGRAM_USER_CACHE_SIZE", "100000")), ttl=float("inf"))
+
+
+# user_id пользователя бота по его Telegram id; пользователь создается при первом обращении
+@instrumentation.timed("db.telegram_user")
+async def telegram_user(telegram_id, telegram_username=None, balance=1000):
+    user_id = _telegram_users.get(telegram_id)
+    if user_id is not None:
+        return user_id
+    async with connection() as db:
+        async with db.execute(SQL_TELEGRAM_USER, (telegram_id, telegram_username, balance)) as cursor:
+            row = await cursor.fetchone()
+        await db.commit()
+    _telegram_users.set(telegram_id, row[0])
+    return row[0]
+
+
+# Регистрация одним выражением: уникальность имени проверяет UNIQUE,
+# user_id выдает rowid. Возвращает user_id или None, если имя занято.
+@instrumentation.timed("db.create_user")
+async def create_user(username, password_hash, first_name=None, last_name=None, telegram_username=None, balance=1000):
+    async with connection() as db:
+        try:
+            async with db.execute(
+                SQL_CREATE_USER, (username, password_hash, first_name, last_name, telegram_username, balance)
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        except sqlite3.IntegrityError:
+            return None
+    return row[0]
+
+
+# Массовая регистрация одной транзакцией, например при импорте пользователей бота.
+# users - кортежи (username, password_hash, first_name, last_name, telegram_username, balance);
+# пользователи без хеша (None) получают UNUSABLE_PASSWORD, занятые имена
+# пропускаются. Возвращает число добавленных пользователей.
+@instrumentation.timed("db.register_many")
+async def register_many(users, chunk_size=10000):
+    added = 0
+    async with connection() as db:
+        chunk = []
+        for username, password_hash, *rest in users:
+            chunk.append((username, password_hash or UNUSABLE_PASSWORD, *rest))
+            if len(chunk) >= chunk_size:
+                added += await _insert_users(db, chunk)
+                chunk = []
+        if chunk:
+            added += await _insert_users(db, chunk)
+        await db.commit()
+    return added
+
+
+async def _insert_users(db, chunk):
+    before = db.total_changes
+    await db.executemany(SQL_CREATE_USERS, chunk)
+    return db.total_changes - before
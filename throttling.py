@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import CallbackQuery
+
+# Входящие обновления: не больше THROTTLE_RATE в секунду на пользователя,
+# кратковременно до THROTTLE_BURST подряд. Почти на каждое обновление бот
+# отвечает, поэтому лимит не выше лимита отправки в чат - иначе очередь
+# ответов одному пользователю росла бы без конца
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "3"))
+THROTTLE_IDLE = float(os.getenv("THROTTLE_IDLE", "60"))
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "1000000"))
+
+# Исходящие сообщения по ограничениям Telegram: около 30 в секунду всего,
+# 1 в секунду в личный чат и 20 в минуту в группу
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+
+# Корзина токенов пользователя без __dict__; dropped - сколько обращений
+# подряд отклонено с последнего разрешенного
+class Bucket:
+    __slots__ = ("tokens", "updated", "dropped")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.dropped = 0
+
+
+# Ограничитель частоты по ключу (корзина токенов).
+# Корзины упорядочены по последнему обращению; корзина, к которой не
+# обращались idle секунд, уже полна и удаляется с начала очереди, поэтому
+# память занимают только активные пользователи.
+class TokenBucketLimiter:
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, idle=THROTTLE_IDLE, maxsize=THROTTLE_MAX_KEYS):
+        if rate <= 0 or burst < 1 or maxsize < 1:
+            raise ValueError("Параметры ограничителя должны быть положительными")
+        self.rate = rate
+        self.burst = burst
+        # Раньше, чем корзина наполнится, удалять ее нельзя
+        self.idle = max(idle, burst / rate)
+        self.maxsize = maxsize
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+        self._buckets = collections.OrderedDict()
+
+    def allow(self, key, cost=1.0):
+        now = time.monotonic()
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = Bucket(self.burst, now)
+            self._evict(now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            buckets.move_to_end(key)
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            bucket.dropped = 0
+            self.allowed += 1
+            return True
+        bucket.dropped += 1
+        self.limited += 1
+        return False
+
+    def dropped(self, key):
+        bucket = self._buckets.get(key)
+        return bucket.dropped if bucket is not None else 0
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest.updated < self.idle and len(buckets) <= self.maxsize:
+                break
+            buckets.popitem(last=False)
+            self.evicted += 1
+
+    def metrics(self):
+        total = self.allowed + self.limited
+        return {
+            "active": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "limited_rate": self.limited / total if total else 0.0,
+            "evicted": self.evicted,
+        }
+
+
+# Мидлварь диспетчера: обновления сверх лимита пользователя отбрасываются
+# до обработчиков - без обращений к базе. Отброшенной кнопке нужен ответ,
+# иначе клиент Telegram показывает индикатор загрузки до таймаута; пустой
+# ответ получает только первая из отброшенных подряд, чтобы флуд кнопками
+# не превращался в такой же поток запросов к Bot API
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limiter=None):
+        self.limiter = limiter or TokenBucketLimiter()
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and not self.limiter.allow(user.id):
+            if isinstance(event, CallbackQuery) and self.limiter.dropped(user.id) == 1:
+                await event.answer()
+            return None
+        return await handler(event, data)
+
+
+# Счетчики планировщика отправки
+class SchedulerStats:
+    def __init__(self):
+        self.sent = 0
+        self.delayed = 0
+        self.delay_time = 0.0
+        self.max_delay = 0.0
+        self.retries = 0
+        self.failed = 0
+
+
+# Планировщик исходящих запросов Bot API (мидлварь сессии бота).
+# Каждый запрос с chat_id получает время отправки по алгоритму GCRA: не
+# раньше, чем позволяет лимит чата и общий лимит бота; запрос ждет своей
+# очереди вместо того, чтобы получить 429. На чат хранится одно число -
+# момент, когда чат снова полностью свободен; прошедшие моменты удаляются.
+# Если Telegram все же ответил 429, запрос повторяется после retry_after.
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 group_rate=SEND_GROUP_RATE, max_retries=SEND_MAX_RETRIES):
+        if global_rate <= 0 or chat_rate <= 0 or group_rate <= 0 or chat_burst < 1:
+            raise ValueError("Параметры планировщика должны быть положительными")
+        self.global_interval = 1 / global_rate
+        self.chat_interval = 1 / chat_rate
+        self.chat_tolerance = (chat_burst - 1) / chat_rate
+        self.group_interval = 1 / group_rate
+        self.max_retries = max_retries
+        self.stats = SchedulerStats()
+        self._global_free = 0.0
+        self._chats = collections.OrderedDict()
+
+    # Время, когда можно отправить в чат; место сразу резервируется
+    def reserve(self, chat_id):
+        now = time.monotonic()
+        chats = self._chats
+        while chats:
+            if next(iter(chats.values())) > now:
+                break
+            chats.popitem(last=False)
+
+        if isinstance(chat_id, int) and chat_id < 0:
+            interval, tolerance = self.group_interval, 0.0
+        else:
+            interval, tolerance = self.chat_interval, self.chat_tolerance
+        free = chats.pop(chat_id, now)
+        at = max(now, free - tolerance, self._global_free)
+        self._global_free = at + self.global_interval
+        chats[chat_id] = max(free, at) + interval
+        return at - now
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        stats = self.stats
+        for attempt in range(self.max_retries + 1):
+            delay = self.reserve(chat_id)
+            if delay > 0:
+                stats.delayed += 1
+                stats.delay_time += delay
+                stats.max_delay = max(stats.max_delay, delay)
+                await asyncio.sleep(delay)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    stats.failed += 1
+                    raise
+                stats.retries += 1
+                logging.warning("Telegram просит подождать %s с (чат %s)", e.retry_after, chat_id)
+                await asyncio.sleep(e.retry_after)
+                continue
+            stats.sent += 1
+            return result
+
+    def metrics(self):
+        stats = self.stats
+        return {
+            "chats": len(self._chats),
+            "sent": stats.sent,
+            "delayed": stats.delayed,
+            "delay_avg": stats.delay_time / stats.delayed if stats.delayed else 0.0,
+            "delay_max": stats.max_delay,
+            "retries": stats.retries,
+            "failed": stats.failed,
+        }
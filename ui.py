@@ -0,0 +1,157 @@
+import os
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+# Язык для пользователей, чей язык Telegram не переведен
+DEFAULT_LANGUAGE = os.getenv("BOT_LANGUAGE", "ru")
+# Адрес страницы мини-приложения, которую открывает кнопка /miniapp
+MINIAPP_URL = os.getenv("MINIAPP_URL", "https://your-domain.com/miniapp")
+
+# Тексты бота по языкам. Шаблоны заполняются одним вызовом format;
+# символы барабанов - позиционные поля {0} {1} {2}
+TEXTS = {
+    "ru": {
+        "start": "Добро пожаловать в казино! 🎲\nВаш начальный баланс: 1000 монет\nВыберите игру:",
+        "slots": (
+            "🎰 Добро пожаловать в игру Слоты!\n"
+            "Нажмите кнопку 'Крутить', чтобы начать игру.\n"
+            "Автоигра: /autoplay <спинов> <ставка>, например /autoplay 10 50 (до {max_spins} спинов)."
+        ),
+        "balance": "Ваш баланс: {balance} монет",
+        "ask_bet": "Введите вашу ставку (целое число):",
+        "win": "🎰 Результат: {0} {1} {2}\n🎉 Поздравляем! Вы выиграли {win} монет!\n💰 Баланс: {balance} монет",
+        "loss": "🎰 Результат: {0} {1} {2}\n😢 К сожалению, вы проиграли {bet} монет.\n💰 Баланс: {balance} монет",
+        "not_a_number": "Пожалуйста, введите корректное число!",
+        "not_positive": "Ставка должна быть положительным числом!",
+        "no_funds": "У вас недостаточно средств!",
+        "miniapp": "🎰 Откройте мини-приложение казино:\n{url}",
+        "autoplay_usage": "Использование: /autoplay <спинов> <ставка>, например /autoplay 10 50",
+        "autoplay_limits": "Число спинов - от 1 до {max_spins}, ставка - положительное число!",
+        "autoplay_result": (
+            "🔁 Автоигра: {played} спинов по {bet} монет\n"
+            "🎉 Выигрышей: {wins} (три в ряд: {triples}, пары: {pairs})\n"
+            "{trend} Итог: {total:+d} монет"
+        ),
+        "autoplay_stopped": "\n⛔ Средств хватило на {played} из {spins} спинов.",
+        "autoplay_balance": "\n💰 Баланс: {balance} монет",
+        "button_slots": "🎰 Слоты",
+        "button_balance": "💰 Баланс",
+        "button_spin": "🎰 Крутить",
+        "button_again": "🔁 Та же ставка",
+        "button_new_bet": "🎰 Крутить снова",
+        "button_miniapp": "Открыть мини-приложение",
+    },
+    "en": {
+        "start": "Welcome to the casino! 🎲\nYour starting balance: 1000 coins\nChoose a game:",
+        "slots": (
+            "🎰 Welcome to Slots!\n"
+            "Press 'Spin' to start playing.\n"
+            "Autoplay: /autoplay <spins> <bet>, e.g. /autoplay 10 50 (up to {max_spins} spins)."
+        ),
+        "balance": "Your balance: {balance} coins",
+        "ask_bet": "Enter your bet (a whole number):",
+        "win": "🎰 Result: {0} {1} {2}\n🎉 Congratulations! You won {win} coins!\n💰 Balance: {balance} coins",
+        "loss": "🎰 Result: {0} {1} {2}\n😢 Sorry, you lost {bet} coins.\n💰 Balance: {balance} coins",
+        "not_a_number": "Please enter a valid number!",
+        "not_positive": "The bet must be a positive number!",
+        "no_funds": "You don't have enough coins!",
+        "miniapp": "🎰 Open the casino mini app:\n{url}",
+        "autoplay_usage": "Usage: /autoplay <spins> <bet>, e.g. /autoplay 10 50",
+        "autoplay_limits": "Spins must be from 1 to {max_spins} and the bet must be a positive number!",
+        "autoplay_result": (
+            "🔁 Autoplay: {played} spins at {bet} coins\n"
+            "🎉 Wins: {wins} (three in a row: {triples}, pairs: {pairs})\n"
+            "{trend} Total: {total:+d} coins"
+        ),
+        "autoplay_stopped": "\n⛔ Your coins covered {played} of {spins} spins.",
+        "autoplay_balance": "\n💰 Balance: {balance} coins",
+        "button_slots": "🎰 Slots",
+        "button_balance": "💰 Balance",
+        "button_spin": "🎰 Spin",
+        "button_again": "🔁 Same bet",
+        "button_new_bet": "🎰 Spin again",
+        "button_miniapp": "Open the mini app",
+    },
+}
+
+# Клавиатуры: ряды кнопок (текст кнопки, callback_data или страница мини-приложения)
+START_BUTTONS = ((("button_slots", "slots"),), (("button_balance", "balance"),))
+SLOTS_BUTTONS = ((("button_spin", "spin_slots"),),)
+RESULT_BUTTONS = (
+    (("button_again", "spin_again"),),
+    (("button_new_bet", "spin_slots"),),
+    (("button_balance", "balance"),),
+)
+MINIAPP_BUTTONS = ((("button_miniapp", WebAppInfo(url=MINIAPP_URL)),),)
+
+# JSON готовых клавиатур по id объекта: тело запроса для них не собирается заново
+_prepared = {}
+
+
+# Клавиатура строится один раз. Объекты aiogram неизменяемы, поэтому
+# одну клавиатуру безопасно передавать во все запросы.
+def keyboard(rows, text):
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=text[label], web_app=data) if isinstance(data, WebAppInfo)
+            else InlineKeyboardButton(text=text[label], callback_data=data)
+            for label, data in row
+        ]
+        for row in rows
+    ])
+    _prepared[id(markup)] = markup.model_dump_json(exclude_none=True)
+    return markup
+
+
+# Тексты и клавиатуры одного языка
+class Locale:
+    def __init__(self, text):
+        self.text = text
+        self.start_keyboard = keyboard(START_BUTTONS, text)
+        self.slots_keyboard = keyboard(SLOTS_BUTTONS, text)
+        self.result_keyboard = keyboard(RESULT_BUTTONS, text)
+        self.miniapp_keyboard = keyboard(MINIAPP_BUTTONS, text)
+        self.miniapp = text["miniapp"].format(url=MINIAPP_URL)
+
+    def result(self, spin, bet, balance):
+        template = self.text["loss" if spin.payout < 0 else "win"]
+        return template.format(*spin.symbols, win=spin.payout, bet=bet, balance=balance)
+
+    # Итог автоигры: played из spins спинов сыграно, total - сумма выплат
+    def autoplay(self, played, spins, bet, triples, pairs, total, balance):
+        text = self.text["autoplay_result"].format(
+            played=played, bet=bet, wins=triples + pairs, triples=triples, pairs=pairs,
+            trend="📈" if total >= 0 else "📉", total=total,
+        )
+        if played < spins:
+            text += self.text["autoplay_stopped"].format(played=played, spins=spins)
+        return text + self.text["autoplay_balance"].format(balance=balance)
+
+
+if DEFAULT_LANGUAGE not in TEXTS:
+    raise ValueError(f"Неизвестный BOT_LANGUAGE: {DEFAULT_LANGUAGE!r}, доступны: {', '.join(TEXTS)}")
+
+LOCALES = {language: Locale(text) for language, text in TEXTS.items()}
+
+
+# Язык пользователя Telegram: "en-US" -> "en", неизвестный - язык по умолчанию
+def locale(user):
+    language = user.language_code if user is not None else None
+    if language:
+        found = LOCALES.get(language[:2])
+        if found is not None:
+            return found
+    return LOCALES[DEFAULT_LANGUAGE]
+
+
+# Мидлварь сессии бота: готовая клавиатура уходит в запрос уже
+# сериализованной строкой, которую сессия передает как есть
+class PreparedMarkupMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        markup = getattr(method, "reply_markup", None)
+        if markup is not None:
+            prepared = _prepared.get(id(markup))
+            if prepared is not None:
+                method.reply_markup = prepared
+        return await make_request(bot, method)
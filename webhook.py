@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from aiohttp import web
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import instrumentation
+from engine import engine
+from fsm import TTLMemoryStorage
+
+# Настройки режима вебхука
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "256"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "4096"))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "10"))
+
+
+# Счетчики обработчика вебхука
+class WebhookStats:
+    def __init__(self):
+        self.received = 0
+        self.rejected = 0
+        self.handled = 0
+        self.failed = 0
+        self.handle_time = 0.0
+        self.max_handle_time = 0.0
+
+
+# Обработчик вебхука с ограничением нагрузки.
+# Telegram получает ответ сразу, обновление обрабатывается в фоне, но не
+# больше concurrency одновременно. Если в работе и в очереди уже max_pending
+# обновлений, запрос отклоняется с 503 - Telegram повторит его позже.
+# При остановке дожидается начатых обновлений не дольше shutdown_timeout.
+class BoundedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher, bot, concurrency=WEBHOOK_CONCURRENCY, max_pending=WEBHOOK_MAX_PENDING,
+                 shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT, secret_token=WEBHOOK_SECRET, **data):
+        if concurrency < 1 or max_pending < 1:
+            raise ValueError("Ограничения обработчика должны быть положительными")
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.shutdown_timeout = shutdown_timeout
+        self.stats = WebhookStats()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._closing = False
+
+    async def _handle_request_background(self, bot, request):
+        self.stats.received += 1
+        if self._closing or len(self._background_feed_update_tasks) >= self.max_pending:
+            self.stats.rejected += 1
+            return web.Response(status=503)
+        return await super()._handle_request_background(bot, request)
+
+    async def _background_feed_update(self, bot, update):
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                await super()._background_feed_update(bot, update)
+            except Exception:
+                self.stats.failed += 1
+                logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+            finally:
+                elapsed = time.perf_counter() - started
+                stats = self.stats
+                stats.handled += 1
+                stats.handle_time += elapsed
+                stats.max_handle_time = max(stats.max_handle_time, elapsed)
+
+    async def close(self):
+        self._closing = True
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+            if pending:
+                logging.warning("Не дождались %d обновлений при остановке", len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        await super().close()
+
+    def metrics(self):
+        stats = self.stats
+        return {
+            "received": stats.received,
+            "rejected": stats.rejected,
+            "handled": stats.handled,
+            "failed": stats.failed,
+            "pending": len(self._background_feed_update_tasks),
+            "handle_time_avg": stats.handle_time / stats.handled if stats.handled else 0.0,
+            "handle_time_max": stats.max_handle_time,
+        }
+
+
+# Приложение aiohttp с вебхуком. Обработчик регистрируется раньше хуков
+# диспетчера, поэтому при остановке сначала дорабатывают начатые обновления,
+# а уже потом выполняется dp.shutdown (сброс журнала спинов, закрытие пула).
+# setup_app(app) добавляет в приложение другие маршруты процесса (API мини-приложения).
+def build_app(dp, bot, path=WEBHOOK_PATH, setup_app=None, **limits):
+    app = web.Application()
+    handler = BoundedRequestHandler(dp, bot, **limits)
+    handler.register(app, path=path)
+    if setup_app is not None:
+        setup_app(app)
+    setup_application(app, dp, bot=bot)
+    app["webhook_handler"] = handler
+    instrumentation.register_gauges("webhook", handler.metrics)
+    return app
+
+
+# Сервер /metrics процесса: у каждого процесса свои счетчики, поэтому
+# процесс number слушает METRICS_PORT + number
+def _serve_metrics(app, number):
+    async def start(app):
+        app["metrics_runner"] = await instrumentation.start_server(port=instrumentation.METRICS_PORT + number)
+
+    async def stop(app):
+        await app["metrics_runner"].cleanup()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+
+
+def _serve(dp, bot, host, port, path, reuse_port, limits, number=0, setup_app=None):
+    # Свой поток исходов в каждом процессе: после fork состояние ГПСЧ общее
+    engine.reseed()
+    app = build_app(dp, bot, path, setup_app, **limits)
+    if instrumentation.METRICS_PORT:
+        _serve_metrics(app, number)
+    web.run_app(app, host=host, port=port, reuse_port=reuse_port,
+                shutdown_timeout=limits.get("shutdown_timeout", WEBHOOK_SHUTDOWN_TIMEOUT), print=None)
+
+
+async def _set_webhook(bot, url, secret_token):
+    await bot.set_webhook(url, secret_token=secret_token, drop_pending_updates=False)
+    await bot.session.close()
+
+
+# Запуск бота в режиме вебхука. Вебхук регистрируется в Telegram один раз,
+# затем workers процессов слушают один порт (SO_REUSEPORT, только Linux).
+# У каждого процесса свой цикл, пул соединений и журнал спинов; SQLite в
+# режиме WAL разделяет их между процессами. Состояния диалогов должны быть
+# общими (FSM_STORAGE=sqlite): ставка может прийти не в тот процесс, что
+# нажатие "Крутить". Общий лимит отправки делится между процессами в main.py.
+def run_webhook(dp, bot, url=WEBHOOK_URL, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                workers=WEBHOOK_WORKERS, secret_token=WEBHOOK_SECRET, setup_app=None, **limits):
+    if workers > 1 and isinstance(dp.fsm.storage, (TTLMemoryStorage, MemoryStorage)):
+        raise ValueError("Для WEBHOOK_WORKERS > 1 нужно общее хранилище состояний: FSM_STORAGE=sqlite")
+    if url:
+        asyncio.run(_set_webhook(bot, url.rstrip("/") + path, secret_token))
+    limits["secret_token"] = secret_token
+    if workers <= 1:
+        _serve(dp, bot, host, port, path, False, limits, setup_app=setup_app)
+        return
+
+    # fork: диспетчер с обработчиками не сериализуется для spawn
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_serve, args=(dp, bot, host, port, path, True, limits, number, setup_app), name=f"webhook-{number}")
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info("Вебхук %s:%d%s, процессов: %d", host, port, path, workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT получают все процессы группы; каждый останавливается сам
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()